@@ -6,14 +6,16 @@ POs suben Excel → IA analiza → Descarga resultado + resumen ejecutivo.
 Seguridad: Ver SECURITY.md
 """
 
+import io
 import os
+import shutil
 import tempfile
 import threading
-import time
+import pandas as pd
 import streamlit as st
 from hu_analyzer import run, get_next_output_path, count_hus_to_analyze, get_hu_speed
-from config import get_api_key, validate_upload, MAX_FILE_SIZE_BYTES, MAX_HUS_PER_RUN
-from word_converter import word_to_excel_file, add_word_as_sheet_to_excel, merge_excel_files
+from config import get_api_key, validate_upload, MAX_FILE_SIZE_BYTES, MAX_HUS_PER_RUN, USE_BATCH_API, BATCH_MIN_HUS
+from word_converter import word_to_excel_bytes, add_word_sheets_to_excel_bytes, merge_excel_files_bytes
 from hu_analyzer import get_common_headers_from_excel
 
 # Modo producción: no exponer stack traces al usuario
@@ -30,109 +32,18 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-# Estilos Actinver Brandbook 2025 — Fondo oscuro
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700&display=swap');
-    
-    /* Fondo principal — Azul Grandeza + gradiente */
-    .stApp {
-        background: linear-gradient(180deg, #0A0E12 0%, #1A2433 100%);
-    }
-    /* Headers */
-    .main-header {
-        font-family: 'Poppins', sans-serif;
-        font-size: 2rem;
-        font-weight: 700;
-        color: #FFFFFF;
-        margin-bottom: 0.5rem;
-        letter-spacing: -0.02em;
-    }
-    .sub-header {
-        font-family: 'Poppins', sans-serif;
-        color: #ADB5C2;
-        font-size: 1rem;
-        margin-bottom: 2rem;
-    }
-    
-    /* Cards y métricas */
-    [data-testid="stMetricValue"], [data-testid="stMetricLabel"] {
-        color: #FFFFFF !important;
-    }
-    div[data-testid="stMetric"] {
-        background: rgba(26, 36, 51, 0.8);
-        border: 1px solid rgba(230, 199, 138, 0.3);
-        border-radius: 12px;
-        padding: 1rem;
-    }
-    
-    /* DataFrames */
-    [data-testid="stDataFrame"] {
-        background: rgba(26, 36, 51, 0.6);
-        border: 1px solid rgba(230, 199, 138, 0.2);
-        border-radius: 8px;
-    }
-    
-    /* Botones primarios — Sunset */
-    .stButton > button[kind="primary"] {
-        background: linear-gradient(135deg, #E6C78A 0%, #D4B56A 100%) !important;
-        color: #0A0E12 !important;
-        font-weight: 600;
-        border: none;
-        border-radius: 8px;
-    }
-    .stButton > button[kind="primary"]:hover {
-        background: linear-gradient(135deg, #EAD2A1 0%, #E6C78A 100%) !important;
-        color: #0A0E12 !important;
-    }
-    
-    /* File uploader */
-    [data-testid="stFileUploader"] {
-        background: rgba(26, 36, 51, 0.8);
-        border: 2px dashed rgba(230, 199, 138, 0.4);
-        border-radius: 12px;
-    }
-    [data-testid="stFileUploader"]:hover {
-        border-color: #E6C78A;
-    }
-    
-    /* Inputs */
-    .stTextInput > div > div > input {
-        background: #1A2433 !important;
-        color: #FFFFFF !important;
-        border: 1px solid rgba(230, 199, 138, 0.3);
-    }
-    
-    /* Progress bar */
-    .stProgress > div > div > div {
-        background: linear-gradient(90deg, #E6C78A, #314566) !important;
-    }
-    
-    /* Info boxes */
-    [data-testid="stAlert"] {
-        background: rgba(26, 36, 51, 0.9);
-        border: 1px solid rgba(230, 199, 138, 0.3);
-        color: #FFFFFF;
-    }
-    
-    /* Ocultar sidebar */
-    [data-testid="stSidebar"] { display: none !important; }
-    [data-testid="stSidebar"] + div { margin-left: 0 !important; }
-    [data-testid="stMain"] { max-width: 100% !important; }
-    
-    /* Loader animado junto a Estado del análisis */
-    .analysis-loader {
-        display: inline-block;
-        animation: spin 1s linear infinite;
-        margin-right: 8px;
-        vertical-align: middle;
-    }
-    @keyframes spin {
-        from { transform: rotate(0deg); }
-        to { transform: rotate(360deg); }
-    }
-</style>
-""", unsafe_allow_html=True)
+# Estilos Actinver Brandbook 2025 — Fondo oscuro (assets/actinver.css)
+_CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "actinver.css")
+
+
+@st.cache_data(show_spinner=False)
+def _css() -> str:
+    """Lee la hoja de estilos una sola vez por proceso."""
+    with open(_CSS_PATH, encoding="utf-8") as f:
+        return f.read()
+
+
+st.markdown(f"<style>{_css()}</style>", unsafe_allow_html=True)
 
 
 # Límite de HUs (0 = todas)
@@ -222,6 +133,35 @@ CONFIG_VERSIONS = {
     },
 }
 
+
+@st.cache_data(show_spinner=False)
+def _badge_html(version_key: str) -> str:
+    """HTML del badge informativo de la versión (se arma una vez por versión)."""
+    cfg = CONFIG_VERSIONS[version_key]
+    return f"""
+    <div style="
+        margin-top: 0.75rem;
+        padding: 0.75rem 1rem;
+        border-radius: 8px;
+        border-left: 4px solid {cfg['badge_color']};
+        background: rgba(26,36,51,0.8);
+        font-family: 'Poppins', sans-serif;
+    ">
+        <div style="font-size:0.8rem; color:#ADB5C2; margin-bottom:0.2rem;">
+            {cfg['audience']}
+        </div>
+        <div style="font-size:0.9rem; color:#FFFFFF;">
+            {cfg['description']}
+        </div>
+        <div style="font-size:0.75rem; color:#ADB5C2; margin-top:0.4rem;">
+            Modelo: <code style="color:{cfg['badge_color']};">{cfg['model']}</code>
+            &nbsp;·&nbsp; max_tokens: {cfg['max_tokens']}
+            &nbsp;·&nbsp; Dimensiones: {', '.join(cfg['dimensions'].keys())}
+        </div>
+    </div>
+    """
+
+
 # ═══════════════════════════════════════════════════════════════════════════
 # HEADER — Logo Actinver (esquina superior izquierda) + Título
 # ═══════════════════════════════════════════════════════════════════════════
@@ -255,98 +195,54 @@ if not uploaded_files:
     st.info("👆 Sube uno o más archivos Excel y/o Word para comenzar el análisis.")
     st.stop()
 
-# Validar cada archivo
+# Validar cada archivo (extensión y .size) antes de leer su contenido
 for f in uploaded_files:
     ok, err_msg = validate_upload(f)
     if not ok:
         st.error(f"❌ {f.name}: {err_msg}")
         st.stop()
 
-# Preparar Excel unificado para análisis
-excel_files = [f for f in uploaded_files if f.name.lower().endswith(".xlsx")]
-word_files = [f for f in uploaded_files if f.name.lower().endswith(".docx")]
+# Leer cada archivo una sola vez: (nombre, bytes) se reutiliza para consolidar
+uploads = [(f.name, f.getvalue()) for f in uploaded_files]
 
-file_id = ""
-base_excel_path = ""
+# Preparar Excel unificado para análisis
+excel_files = [(name, data) for name, data in uploads if name.lower().endswith(".xlsx")]
+word_files = [(name, data) for name, data in uploads if name.lower().endswith(".docx")]
 
-with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-    base_excel_path = tmp.name
+# Nombres de los archivos subidos: de aquí salen file_id (display / reset) y el nombre de salida
+upload_names = {"excel": [name for name, _ in excel_files], "word": [name for name, _ in word_files]}
+st.session_state.upload_names = upload_names
+base_excel_bio = None  # Excel consolidado en memoria (BytesIO)
 
 try:
     if excel_files and word_files:
         # Excel(es) + Word: consolidar Excels, luego agregar Words como hojas con formato común
-        excel_paths = []
-        for ef in excel_files:
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-            tmp.write(ef.getvalue())
-            tmp.close()
-            excel_paths.append(tmp.name)
-        if len(excel_paths) == 1:
-            with open(base_excel_path, "wb") as f:
-                f.write(open(excel_paths[0], "rb").read())
+        if len(excel_files) == 1:
+            base_excel_bio = io.BytesIO(excel_files[0][1])
         else:
-            merge_excel_files(excel_paths, base_excel_path)
-        for p in excel_paths:
-            if os.path.exists(p):
-                os.unlink(p)
-        common_headers = get_common_headers_from_excel(base_excel_path)
-        for wf in word_files:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as wt:
-                wt.write(wf.getvalue())
-                wt_path = wt.name
-            try:
-                add_word_as_sheet_to_excel(
-                    base_excel_path, wt_path,
-                    initiative_name=os.path.splitext(wf.name)[0],
-                    common_headers=common_headers if common_headers else None,
-                )
-            finally:
-                if os.path.exists(wt_path):
-                    os.unlink(wt_path)
-        file_id = " + ".join(ef.name for ef in excel_files) + " + " + ", ".join(w.name for w in word_files)
+            base_excel_bio = merge_excel_files_bytes(excel_files)
+        common_headers = get_common_headers_from_excel(base_excel_bio)
+        base_excel_bio = add_word_sheets_to_excel_bytes(
+            base_excel_bio,
+            [(os.path.splitext(name)[0], data) for name, data in word_files],
+            common_headers=common_headers if common_headers else None,
+        )
     elif excel_files:
         # Solo Excel(es): consolidar todos en uno
         if len(excel_files) == 1:
-            with open(base_excel_path, "wb") as f:
-                f.write(excel_files[0].getvalue())
+            base_excel_bio = io.BytesIO(excel_files[0][1])
         else:
-            excel_paths = []
-            for ef in excel_files:
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-                tmp.write(ef.getvalue())
-                tmp.close()
-                excel_paths.append(tmp.name)
-            merge_excel_files(excel_paths, base_excel_path)
-            for p in excel_paths:
-                if os.path.exists(p):
-                    os.unlink(p)
-        file_id = " + ".join(ef.name for ef in excel_files)
+            base_excel_bio = merge_excel_files_bytes(excel_files)
     elif word_files:
         # Solo Word(s): convertir a Excel consolidado
-        first_word = word_files[0]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as wt:
-            wt.write(first_word.getvalue())
-            wt_path = wt.name
-        try:
-            word_to_excel_file(wt_path, base_excel_path)
-            common_headers = get_common_headers_from_excel(base_excel_path)
-            for wf in word_files[1:]:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as wt2:
-                    wt2.write(wf.getvalue())
-                    wt2_path = wt2.name
-                try:
-                    add_word_as_sheet_to_excel(
-                        base_excel_path, wt2_path,
-                        initiative_name=os.path.splitext(wf.name)[0],
-                        common_headers=common_headers if common_headers else None,
-                    )
-                finally:
-                    if os.path.exists(wt2_path):
-                        os.unlink(wt2_path)
-        finally:
-            if os.path.exists(wt_path):
-                os.unlink(wt_path)
-        file_id = ", ".join(w.name for w in word_files)
+        first_name, first_data = word_files[0]
+        base_excel_bio = word_to_excel_bytes(first_data, os.path.splitext(first_name)[0])
+        common_headers = get_common_headers_from_excel(base_excel_bio)
+        base_excel_bio = add_word_sheets_to_excel_bytes(
+            base_excel_bio,
+            [(os.path.splitext(name)[0], data) for name, data in word_files[1:]],
+            common_headers=common_headers if common_headers else None,
+        )
     else:
         st.error("No se encontraron archivos válidos.")
         st.stop()
@@ -358,19 +254,35 @@ except Exception as e:
         st.exception(e)
     st.stop()
 
-if not file_id:
+if base_excel_bio is None:
     st.stop()
 
-# Objeto compatible con el flujo de análisis (path ya está en base_excel_path)
+file_id = " + ".join(upload_names["excel"] + ([", ".join(upload_names["word"])] if upload_names["word"] else []))
+
+
+@st.cache_resource(show_spinner=False)
+def _anthropic_client(api_key: str):
+    """Cliente Anthropic compartido entre reruns (reutiliza su pool de conexiones HTTP)."""
+    import anthropic
+    return anthropic.Anthropic(api_key=api_key)
+
+
+def _write_xlsx(src, path: str) -> None:
+    """Copia un file-like a disco en bloques de 1 MB (sin duplicar el contenido en memoria)."""
+    src.seek(0)
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1 << 20)
+
+
+# Objeto compatible con el flujo de análisis (el Excel consolidado vive en memoria)
 class _UploadedExcel:
-    def __init__(self, path, name):
-        self._path = path
+    def __init__(self, bio, name):
+        self._bio = bio
         self.name = name
     def getvalue(self):
-        with open(self._path, "rb") as f:
-            return f.read()
+        return self._bio.getvalue()
 
-uploaded_file = _UploadedExcel(base_excel_path, file_id)
+uploaded_file = _UploadedExcel(base_excel_bio, file_id)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # HISTÓRICO (opcional)
@@ -386,13 +298,11 @@ with st.expander("📜 **Histórico (opcional)** — Comparar con análisis ante
         key="prev_file_uploader",
     )
 
-prev_analysis_path = None
+prev_analysis_file = None
 if prev_uploaded:
     ok_prev, err_prev = validate_upload(prev_uploaded)
     if ok_prev:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_prev:
-            tmp_prev.write(prev_uploaded.getvalue())
-            prev_analysis_path = tmp_prev.name
+        prev_analysis_file = prev_uploaded
         st.success(f"✓ Histórico cargado: {prev_uploaded.name}")
     else:
         st.warning(f"⚠ {err_prev}")
@@ -443,32 +353,8 @@ with sw_col2:
         if v == selected_label:
             st.session_state.selected_version = k
 
-    cfg = CONFIG_VERSIONS[st.session_state.selected_version]
-
     # Badge informativo de la versión activa
-    badge_html = f"""
-    <div style="
-        margin-top: 0.75rem;
-        padding: 0.75rem 1rem;
-        border-radius: 8px;
-        border-left: 4px solid {cfg['badge_color']};
-        background: rgba(26,36,51,0.8);
-        font-family: 'Poppins', sans-serif;
-    ">
-        <div style="font-size:0.8rem; color:#ADB5C2; margin-bottom:0.2rem;">
-            {cfg['audience']}
-        </div>
-        <div style="font-size:0.9rem; color:#FFFFFF;">
-            {cfg['description']}
-        </div>
-        <div style="font-size:0.75rem; color:#ADB5C2; margin-top:0.4rem;">
-            Modelo: <code style="color:{cfg['badge_color']};">{cfg['model']}</code>
-            &nbsp;·&nbsp; max_tokens: {cfg['max_tokens']}
-            &nbsp;·&nbsp; Dimensiones: {', '.join(cfg['dimensions'].keys())}
-        </div>
-    </div>
-    """
-    st.markdown(badge_html, unsafe_allow_html=True)
+    st.markdown(_badge_html(st.session_state.selected_version), unsafe_allow_html=True)
 
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -482,6 +368,7 @@ if analyze_btn and uploaded_file:
         st.stop()
 
     os.environ["ANTHROPIC_API_KEY"] = api_key
+    client = _anthropic_client(api_key)
 
     # ── Aplicar config de versión activa ──────────────────────────────────
     import hu_analyzer as _hua
@@ -496,20 +383,19 @@ if analyze_btn and uploaded_file:
     if effective_limit is not None and effective_limit > MAX_HUS_PER_RUN:
         effective_limit = MAX_HUS_PER_RUN
 
-    path_to_use = base_excel_path
-    original_name = uploaded_file.name
-    if " + " in original_name:
-        original_name = original_name.split(" + ")[0]
-    elif ", " in original_name:
-        original_name = original_name.split(", ")[0] + ".xlsx"
-    output_path = get_next_output_path(path_to_use, original_filename=original_name)
+    names = st.session_state.upload_names
+    # Nombre base de la salida: primer Excel, o el primer Word (la salida siempre es .xlsx)
+    original_name = names["excel"][0] if names["excel"] else os.path.splitext(names["word"][0])[0] + ".xlsx"
+    output_path = get_next_output_path(original_name, original_filename=original_name)
 
     # Análisis de alto nivel: contar HUs a analizar
-    total_hus = count_hus_to_analyze(path_to_use, limit=effective_limit)
+    total_hus = count_hus_to_analyze(base_excel_bio, limit=effective_limit)
     if total_hus == 0:
         st.warning("No se encontraron HUs para analizar en el archivo.")
         st.stop()
     hu_speed_initial = get_hu_speed()
+    # Message Batch solo para lotes grandes (en lotes chicos pesa más la espera de la cola)
+    analysis_mode = "batch" if USE_BATCH_API and total_hus > BATCH_MIN_HUS else "stream"
 
     # Inicializar estado de progreso
     st.session_state.analysis_completed = 0
@@ -521,31 +407,43 @@ if analyze_btn and uploaded_file:
     st.session_state.analysis_error = None
     st.session_state.analysis_done = False
     st.session_state.analysis_running = True
-    st.session_state.analysis_temp_paths = [base_excel_path, prev_analysis_path] if prev_analysis_path else [base_excel_path]
 
     # Dict compartido (evita "missing ScriptRunContext" al no usar st.session_state desde el thread)
     progress_data = {
         "completed": 0, "total": total_hus, "hu_speed": hu_speed_initial or 0,
-        "last_time": 0, "eta_sec": 0, "summary": None, "error": None, "done": False,
+        "last_time": 0, "eta_sec": 0, "cache_read_tokens": 0,
+        "summary": None, "error": None, "done": False,
     }
 
-    def _progress_cb(completed, total, hu_speed, last_time, eta):
+    def _progress_cb(completed, total, hu_speed, last_time, eta, cache_read_tokens=0):
         progress_data["completed"] = completed
         progress_data["total"] = total
         progress_data["hu_speed"] = hu_speed
         progress_data["last_time"] = last_time
         progress_data["eta_sec"] = eta
+        progress_data["cache_read_tokens"] = cache_read_tokens
 
     def _run_analysis():
         try:
-            summary = run(
-                path_to_use,
-                output_path,
-                limit=effective_limit,
-                silent=True,
-                previous_analysis_path=prev_analysis_path,
-                progress_callback=_progress_cb,
-            )
+            # run() necesita rutas: los temporales viven en un directorio que se borra al terminar
+            with tempfile.TemporaryDirectory(prefix="hu_analyzer_") as tmp_dir:
+                base_excel_path = os.path.join(tmp_dir, "base.xlsx")
+                _write_xlsx(base_excel_bio, base_excel_path)
+                prev_analysis_path = None
+                if prev_analysis_file is not None:
+                    prev_analysis_path = os.path.join(tmp_dir, "previo.xlsx")
+                    _write_xlsx(prev_analysis_file, prev_analysis_path)
+                summary = run(
+                    base_excel_path,
+                    output_path,
+                    limit=effective_limit,
+                    silent=True,
+                    previous_analysis_path=prev_analysis_path,
+                    progress_callback=_progress_cb,
+                    use_cache=True,
+                    mode=analysis_mode,
+                    client=client,
+                )
             progress_data["summary"] = summary
             progress_data["output_path"] = output_path
         except Exception as e:
@@ -557,61 +455,78 @@ if analyze_btn and uploaded_file:
         finally:
             progress_data["done"] = True
 
+    # El panel de progreso (fragment) lee este dict desde session_state en cada tick
+    st.session_state.analysis_progress = progress_data
     th = threading.Thread(target=_run_analysis)
     th.start()
 
-    # Barra de progreso en bucle (actualización en tiempo real)
-    progress_placeholder = st.empty()
-    status_placeholder = st.empty()
-    while th.is_alive():
-        c = progress_data["completed"]
-        t = progress_data["total"]
-        speed = progress_data["hu_speed"]
-        last_t = progress_data["last_time"]
-        eta = progress_data["eta_sec"]
-        pct = c / t if t else 0
-        eta_str = f"{int(eta // 60)}m {int(eta % 60)}s" if eta > 0 else "calculando..."
-
-        with progress_placeholder.container():
-            st.markdown(
-                '<h3 style="display:flex; align-items:center;">'
-                '<span class="analysis-loader">⏳</span> Estado del análisis</h3>',
-                unsafe_allow_html=True,
-            )
-            st.progress(pct, text=f"Analizando HUs: {c} / {t} completadas")
-        with status_placeholder.container():
-            st.markdown(f"**Progreso:** {c} / {t} HUs analizadas · **Faltan:** {t - c}")
-            st.markdown(f"**HU Speed Analysis:** {speed:.1f}s por HU · **Última HU:** {last_t:.1f}s · **ETA:** {eta_str}")
-            m1, m2, m3 = st.columns(3)
-            with m1:
-                st.metric("Completadas", f"{c} / {t}", f"{t - c} restantes")
-            with m2:
-                st.metric("HU Speed Analysis", f"{speed:.1f}s", "promedio por HU")
-            with m3:
-                st.metric("Tiempo estimado", eta_str, "")
-        time.sleep(1)
-
-    th.join()
-    # Copiar resultados a session_state (en el hilo principal) para el resto de la app
-    st.session_state.analysis_done = progress_data["done"]
-    st.session_state.analysis_summary = progress_data.get("summary")
-    st.session_state.analysis_output_path = progress_data.get("output_path")
-    st.session_state.analysis_error = progress_data.get("error")
-    st.session_state.analysis_running = False
-    st.rerun()
+
+@st.cache_data(show_spinner=False)
+def _progress_template() -> str:
+    """Plantilla HTML del panel de progreso (un solo bloque en lugar de 7 widgets por tick)."""
+    return (
+        '<h3 style="display:flex; align-items:center;">'
+        '<span class="analysis-loader">⏳</span> Estado del análisis</h3>'
+        '<div style="font-size:0.9rem;">Analizando HUs: {c} / {t} completadas</div>'
+        '<div class="progress-track"><div class="progress-fill" style="width:{pct:.1f}%;"></div></div>'
+        '<p><b>Progreso:</b> {c} / {t} HUs analizadas · <b>Faltan:</b> {left}</p>'
+        '<p><b>HU Speed Analysis:</b> {speed:.1f}s por HU · <b>Última HU:</b> {last_t:.1f}s · <b>ETA:</b> {eta}</p>'
+        '<p style="font-size:0.8rem; color:#ADB5C2;">Prompt cache: {cached_tok} tokens reutilizados</p>'
+        '<div class="progress-metrics">'
+        '<div class="progress-metric"><div class="label">Completadas</div>'
+        '<div class="value">{c} / {t}</div><div class="delta">{left} restantes</div></div>'
+        '<div class="progress-metric"><div class="label">HU Speed Analysis</div>'
+        '<div class="value">{speed:.1f}s</div><div class="delta">promedio por HU</div></div>'
+        '<div class="progress-metric"><div class="label">Tiempo estimado</div>'
+        '<div class="value">{eta}</div><div class="delta">&nbsp;</div></div>'
+        '</div>'
+    )
+
+
+@st.fragment(run_every=1)
+def _progress_panel():
+    """
+    Panel de progreso como fragment: cada segundo solo se re-ejecuta este bloque, no toda la página.
+    Al terminar el análisis copia resultados a session_state y hace un rerun completo de la app.
+    """
+    progress_data = st.session_state.get("analysis_progress")
+    if not progress_data:
+        return
+    if progress_data["done"]:
+        # Copiar resultados a session_state para el resto de la app
+        st.session_state.analysis_done = True
+        st.session_state.analysis_summary = progress_data.get("summary")
+        st.session_state.analysis_output_path = progress_data.get("output_path")
+        st.session_state.analysis_error = progress_data.get("error")
+        st.session_state.analysis_running = False
+        st.session_state.analysis_progress = None
+        st.rerun()
+
+    c = progress_data["completed"]
+    t = progress_data["total"]
+    speed = progress_data["hu_speed"]
+    last_t = progress_data["last_time"]
+    eta = progress_data["eta_sec"]
+    cached_tok = progress_data["cache_read_tokens"]
+    pct = c / t if t else 0
+    eta_str = f"{int(eta // 60)}m {int(eta % 60)}s" if eta > 0 else "calculando..."
+
+    st.markdown(
+        _progress_template().format(
+            pct=pct * 100, c=c, t=t, left=t - c, speed=speed, last_t=last_t,
+            eta=eta_str, cached_tok=f"{cached_tok:,}",
+        ),
+        unsafe_allow_html=True,
+    )
+
+
+if st.session_state.get("analysis_running") and st.session_state.get("analysis_progress"):
+    _progress_panel()
 
 if st.session_state.get("analysis_done") and st.session_state.get("analysis_error"):
     err = st.session_state.analysis_error
     st.session_state.analysis_done = False
     st.session_state.analysis_running = False
-    if st.session_state.get("analysis_temp_paths"):
-        for p in st.session_state.analysis_temp_paths:
-            if p and os.path.exists(p):
-                try:
-                    os.unlink(p)
-                except OSError:
-                    pass
-        st.session_state.analysis_temp_paths = []
     if err == "game_over":
         st.markdown(
             '<div style="text-align:center; padding:2rem; font-size:3rem; font-weight:bold; color:#ff4b4b;">🎮 GAME OVER</div>',
@@ -627,14 +542,6 @@ if st.session_state.get("analysis_done") and st.session_state.get("analysis_summ
     st.session_state.output_path = st.session_state.analysis_output_path
     st.session_state.analysis_done = False
     st.session_state.analysis_running = False
-    if st.session_state.get("analysis_temp_paths"):
-        for p in st.session_state.analysis_temp_paths:
-            if p and os.path.exists(p):
-                try:
-                    os.unlink(p)
-                except OSError:
-                    pass
-        st.session_state.analysis_temp_paths = []
     st.success("✅ Análisis completado")
     st.rerun()
 
@@ -642,6 +549,16 @@ if st.session_state.get("analysis_done") and st.session_state.get("analysis_summ
 # RESUMEN Y DESCARGA
 # ═══════════════════════════════════════════════════════════════════════════
 
+@st.cache_data(show_spinner=False, max_entries=1)
+def _read_output_bytes(path: str, mtime: float) -> bytes:
+    """
+    Lee el Excel de salida una vez por versión del archivo (mtime en la llave de caché).
+    Solo se guarda la última salida: un análisis nuevo reemplaza al anterior en memoria.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
 if st.session_state.get("summary") and st.session_state.get("output_path"):
     summary = st.session_state.summary
     output_path = st.session_state.output_path
@@ -697,7 +614,6 @@ if st.session_state.get("summary") and st.session_state.get("output_path"):
     st.markdown("### Distribución por nivel de completitud")
     dist_col1, dist_col2 = st.columns(2)
     with dist_col1:
-        import pandas as pd
         dist_df = pd.DataFrame([
             {"Nivel": "🟢 Excelente (90-100)", "HUs": exc, "Estado": "Lista para prerefinamiento"},
             {"Nivel": "🔵 Completa (75-89)", "HUs": summary.get("completas", 0), "Estado": "Clarificaciones opcionales"},
@@ -721,11 +637,9 @@ if st.session_state.get("summary") and st.session_state.get("output_path"):
     st.markdown("### 📥 Descargar resultado")
     if output_path and os.path.exists(output_path):
         try:
-            with open(output_path, "rb") as f:
-                file_bytes = f.read()
             st.download_button(
                 label="⬇️ Descargar Excel analizado",
-                data=file_bytes,
+                data=_read_output_bytes(output_path, os.path.getmtime(output_path)),
                 file_name=os.path.basename(output_path),
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 type="primary",
@@ -3,7 +3,31 @@ Configuración de seguridad y límites — HU Analyzer Platform
 Ver SECURITY.md para análisis de riesgos.
 """
 
-import re
+import os
+import posixpath
+from functools import lru_cache
+
+try:
+    import tomllib
+except ImportError:  # Python 3.10
+    import tomli as tomllib
+
+
+class _SanitizeTable(dict):
+    """
+    Tabla para str.translate: conserva lo que \\w acepta (alfanuméricos Unicode y "_") más "-" y ".";
+    todo lo demás pasa a "_". Los code points se resuelven la primera vez que aparecen y quedan en la tabla.
+    """
+    def __missing__(self, cp: int):
+        ch = chr(cp)
+        value = cp if (ch.isalnum() or ch in "_-.") else "_"
+        self[cp] = value
+        return value
+
+
+# ASCII precargado; el resto se resuelve bajo demanda en __missing__
+_SANITIZE_TABLE = _SanitizeTable()
+_SANITIZE_TABLE.update((cp, _SANITIZE_TABLE.__missing__(cp)) for cp in range(128))
 
 
 class AnthropicGameOverError(Exception):
@@ -16,6 +40,8 @@ class AnthropicGameOverError(Exception):
 
 # Tamaño máximo de archivo subido (bytes) — 25 MB
 MAX_FILE_SIZE_BYTES = 25 * 1024 * 1024
+_MAX_SIZE_MB = MAX_FILE_SIZE_BYTES // (1024 * 1024)
+_SIZE_ERR = f"El archivo excede el tamaño máximo permitido ({_MAX_SIZE_MB} MB)."  # mensaje precalculado
 
 # Límite máximo de HUs por análisis (evitar costos excesivos)
 MAX_HUS_PER_RUN = 200
@@ -23,22 +49,45 @@ MAX_HUS_PER_RUN = 200
 # HUs analizadas en paralelo (5 = Tier 1 ~50 RPM; 10+ si tienes Tier 2+)
 MAX_CONCURRENT_ANALYSIS = 5
 
-# Tipos de archivo permitidos
-ALLOWED_EXTENSIONS = {".xlsx", ".docx"}
+# HUs por llamada a Claude (1 = una por llamada). Con >1 el system prompt y las instrucciones
+# se envían una vez por grupo; si la respuesta del grupo no es válida se reanaliza HU por HU.
+HUS_PER_REQUEST = 1
+
+# Timeout por llamada a Claude en segundos por HU (0 = el del SDK, ~10 min). Una generación
+# atorada se corta y se reintenta en lugar de frenar al worker que la espera.
+ANALYSIS_TIMEOUT_SECONDS = 90
+
+# Tokens de entrada por minuto que se permiten enviar (límite ITPM de tu tier; 0 = sin límite).
+# Con límite, los workers esperan cupo antes de cada llamada en lugar de encadenar 429s.
+MAX_INPUT_TOKENS_PER_MINUTE = 0
+
+# Con análisis anterior: las HUs cuyo contenido no cambió reutilizan ese resultado sin llamar
+# a Claude (el score total se recalcula con los pesos actuales). --no-cache lo desactiva.
+REUSE_UNCHANGED_PREVIOUS = True
+
+# Message Batches API: procesa las HUs del lado de Anthropic (50% de costo, pero la
+# respuesta puede tardar minutos). Solo se usa si está activo y hay más de BATCH_MIN_HUS.
+USE_BATCH_API = False
+BATCH_MIN_HUS = 8
+BATCH_POLL_SECONDS = 10
+
+# Tipos de archivo permitidos (inmutable)
+ALLOWED_EXTENSIONS = frozenset({".xlsx", ".docx"})
 
 
 def sanitize_filename(name: str) -> str:
     """Elimina caracteres peligrosos para evitar path traversal."""
     if not name or not isinstance(name, str):
         return "upload.xlsx"
-    # Quitar path, solo nombre base
-    base = name.split("/")[-1].split("\\")[-1]
+    # Quitar path, solo nombre base (separadores "/" y "\\", sin listas intermedias)
+    base = posixpath.basename(name.replace("\\", "/"))
     # Solo alfanuméricos, guiones, puntos
-    safe = re.sub(r"[^\w\-\.]", "_", base)
+    safe = base.translate(_SANITIZE_TABLE)
     return safe[:100] if safe else "upload.xlsx"
 
 
-def get_api_key():
+@lru_cache(maxsize=1)
+def _load_api_key() -> str:
     """
     Obtiene API key de forma segura:
     1. st.secrets (Streamlit Cloud)
@@ -53,7 +102,6 @@ def get_api_key():
                 return str(key).strip()
     except Exception:
         pass
-    import os
     key = os.environ.get("ANTHROPIC_API_KEY") or ""
     if not key:
         # Cargar desde .streamlit/secrets.toml cuando se ejecuta por CLI
@@ -61,33 +109,58 @@ def get_api_key():
         secrets_path = os.path.join(script_dir, ".streamlit", "secrets.toml")
         if os.path.exists(secrets_path):
             try:
-                with open(secrets_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                import re
-                m = re.search(r'ANTHROPIC_API_KEY\s*=\s*["\']([^"\']+)["\']', content)
-                if m:
-                    key = m.group(1).strip()
+                with open(secrets_path, "rb") as f:
+                    key = str(tomllib.load(f).get("ANTHROPIC_API_KEY") or "").strip()
             except Exception:
-                pass
+                pass  # TOML mal formado: se ignora como antes
     return key.strip()
 
 
+def get_api_key() -> str:
+    """
+    API key de Anthropic (ver _load_api_key). Se resuelve una vez por proceso;
+    si no se encontró no se cachea, para que configurarla después surta efecto.
+    """
+    key = _load_api_key()
+    if not key:
+        _load_api_key.cache_clear()
+    return key
+
+
+def clear_api_key_cache() -> None:
+    """Olvida la API key resuelta (ej. tras cambiar secrets.toml o ANTHROPIC_API_KEY en caliente)."""
+    _load_api_key.cache_clear()
+
+
 def validate_upload(file, max_size: int = MAX_FILE_SIZE_BYTES) -> tuple[bool, str]:
     """
-    Valida archivo subido. Retorna (ok, error_message).
+    Valida archivo subido sin leer su contenido. Retorna (ok, error_message).
     """
     if file is None:
         return False, "No se recibió ningún archivo."
 
-    # Tamaño (Streamlit UploadedFile tiene .size, sino usamos len de bytes)
-    size = getattr(file, "size", None) or len(file.getvalue()) if hasattr(file, "getvalue") else 0
-    if size > max_size:
-        return False, f"El archivo excede el tamaño máximo permitido ({max_size // (1024*1024)} MB)."
-
-    # Extensión
+    # Extensión primero: rechazar sin tocar el contenido
     name = getattr(file, "name", "") or "upload"
     name_lower = name.lower().strip()
-    if not (name_lower.endswith(".xlsx") or name_lower.endswith(".docx")):
+    # rpartition (no splitext): un nombre como ".xlsx" sigue contando como Excel, igual que con endswith;
+    # sin punto ("xlsx") no hay extensión y se rechaza
+    _, dot, ext = name_lower.rpartition(".")
+    if not dot or "." + ext not in ALLOWED_EXTENSIONS:
         return False, "Solo se permiten archivos Excel (.xlsx) o Word (.docx)."
 
+    # Tamaño: .size (Streamlit UploadedFile), luego seek/tell (sin copiar el contenido)
+    size = getattr(file, "size", None)
+    if size is None:
+        try:
+            pos = file.tell()
+            file.seek(0, 2)
+            size = file.tell()
+            file.seek(pos)
+        except Exception:
+            size = 0
+    if size > max_size:
+        if max_size == MAX_FILE_SIZE_BYTES:
+            return False, _SIZE_ERR
+        return False, f"El archivo excede el tamaño máximo permitido ({max_size // (1024*1024)} MB)."
+
     return True, ""
@@ -18,6 +18,8 @@ USO:
     python hu_analyzer.py --input HUs_Compilado.xlsx --output resultado.xlsx
     python hu_analyzer.py --input HUs_Compilado.xlsx --limit 5   # prueba rápida
     python hu_analyzer.py --input HUs_Compilado.xlsx --sheet "Onboarding"
+    python hu_analyzer.py --input HUs_Compilado.xlsx --no-cache  # ignora .hu_cache/
+    python hu_analyzer.py --input HUs_Compilado.xlsx --batch     # Message Batches API (50% costo)
 
 SALIDA:
     - Por defecto: carpeta Output/ con archivos HUs_Compilado_analizado_v1.0.xlsx,
@@ -26,62 +28,228 @@ SALIDA:
 ================================================================================
 """
 
-import anthropic
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 import json
 import argparse
+import atexit
+import bisect
 import sys
 import os
 import re
 import time
 import difflib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import heapq
+import tempfile
+import threading
+import multiprocessing
+import queue
+from collections import Counter, defaultdict
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import anthropic  # solo para anotaciones; el SDK se importa al usarlo (~1 s de arranque)
+
+try:
+    import fcntl  # lock entre procesos del archivo de versión (no existe en Windows)
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson  # JSON más rápido; opcional
+except ImportError:
+    orjson = None
+
+try:
+    from rapidfuzz import fuzz as _rf_fuzz  # similitud en C++; opcional
+except ImportError:  # sin rapidfuzz: difflib (mismo rango 0-1, más lento)
+    _rf_fuzz = None
 
 class AnthropicGameOverError(Exception):
     """Se acabaron tokens/créditos en la cuenta Anthropic."""
 
 
+def _json_loads(data):
+    """json.loads con orjson si está instalado (acepta str o bytes; mismo JSONDecodeError)."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """
+    Serializa a JSON UTF-8 compacto (bytes) con orjson si está instalado; lo no serializable va con str().
+    Los bytes pueden variar según la rama (ej. 1e16 vs 1e+16, null vs NaN): para huellas usar _json_key.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _json_key(obj) -> bytes:
+    """
+    JSON canónico para huellas de caché: siempre el json estándar (llaves ordenadas), así la
+    misma HU tiene la misma huella en .hu_cache/ con o sin orjson instalado.
+    """
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+                      default=str).encode("utf-8")
+
+
 # Carpeta donde se guardan los archivos de análisis (con numeración v1.0, v2.0...)
 OUTPUT_DIR = "Output"
 
 # Archivo para persistir HU Speed (promedio de segundos por HU)
 _HU_SPEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".hu_analyzer_speed.json")
+_HU_SPEED_LOCK = threading.Lock()  # protege _speed_state entre hilos
+_SPEED_FLUSH_EVERY = 25            # HUs entre escrituras del archivo
 
+# Promedio en memoria; se carga del archivo la primera vez y se escribe cada _SPEED_FLUSH_EVERY HUs,
+# al terminar cada run() y al salir del proceso
+_speed_state = {"avg": 0.0, "n": 0, "loaded": False, "pending": 0}
 
-def get_hu_speed() -> float | None:
-    """Retorna el promedio de segundos por HU (HU Speed Analysis) o None si no hay datos."""
+
+def _load_speed_locked() -> None:
+    """Carga el promedio desde el archivo (solo la primera vez). Requiere _HU_SPEED_LOCK."""
+    if _speed_state["loaded"]:
+        return
+    _speed_state["loaded"] = True
     try:
         if os.path.exists(_HU_SPEED_FILE):
-            with open(_HU_SPEED_FILE) as f:
-                data = json.load(f)
-            return float(data.get("avg_seconds", 0)) or None
+            with open(_HU_SPEED_FILE, "rb") as f:
+                data = _json_loads(f.read())
+            _speed_state["avg"] = float(data.get("avg_seconds", 0))
+            _speed_state["n"] = int(data.get("count", 0))
     except Exception:
         pass
-    return None
+
+
+def _flush_speed() -> None:
+    """Escribe el promedio en memoria al archivo (atómico con os.replace) si hay cambios pendientes."""
+    with _HU_SPEED_LOCK:
+        if not _speed_state["pending"]:
+            return
+        payload = _json_dumps({"avg_seconds": round(_speed_state["avg"], 2), "count": _speed_state["n"]})
+        _speed_state["pending"] = 0
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(_HU_SPEED_FILE), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, _HU_SPEED_FILE)
+    except Exception:
+        pass
+
+
+atexit.register(_flush_speed)
+
+
+def get_hu_speed() -> float | None:
+    """Retorna el promedio de segundos por HU (HU Speed Analysis) o None si no hay datos."""
+    with _HU_SPEED_LOCK:
+        _load_speed_locked()
+        return round(_speed_state["avg"], 2) or None
 
 
 def update_hu_speed(elapsed_sec: float) -> float:
     """
     Actualiza HU Speed con el tiempo de una HU analizada.
     Usa promedio móvil: nuevo_avg = (avg_anterior * n + elapsed) / (n + 1)
-    Retorna el nuevo promedio.
+    Retorna el nuevo promedio. El archivo se escribe cada _SPEED_FLUSH_EVERY HUs (ver _flush_speed).
     """
-    try:
-        data = {"avg_seconds": 0.0, "count": 0}
-        if os.path.exists(_HU_SPEED_FILE):
-            with open(_HU_SPEED_FILE) as f:
-                data = json.load(f)
-        avg = float(data.get("avg_seconds", 0))
-        n = int(data.get("count", 0))
+    with _HU_SPEED_LOCK:
+        _load_speed_locked()
+        avg, n = _speed_state["avg"], _speed_state["n"]
         new_avg = (avg * n + elapsed_sec) / (n + 1)
-        with open(_HU_SPEED_FILE, "w") as f:
-            json.dump({"avg_seconds": round(new_avg, 2), "count": n + 1}, f)
-        return new_avg
+        _speed_state["avg"], _speed_state["n"] = new_avg, n + 1
+        _speed_state["pending"] += 1
+        flush = _speed_state["pending"] >= _SPEED_FLUSH_EVERY
+    if flush:
+        _flush_speed()
+    return new_avg
+
+
+# Caché en disco de análisis ya hechos (re-subir el mismo Excel no vuelve a llamar a Claude)
+_HU_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".hu_cache")
+
+
+def _hu_cache_key(hu: dict, prev_data: dict = None) -> str:
+    """
+    Huella de una HU para la caché: huella de contenido (_hu_content_key, incluye el análisis
+    anterior) + modelo + system prompt activos (cambiar de versión invalida la caché)
+    + instrucciones de análisis y ANALYSIS_PROMPT_VERSION.
+    Usa el contenido normalizado: la misma HU con otro ID, mayúsculas, espacios o viñetas
+    reutiliza el análisis guardado en otra corrida, igual que la deduplicación dentro de una corrida.
+    """
+    mod = sys.modules[__name__]
+    payload = {
+        "content": _hu_content_key(hu, prev_data),
+        "model": getattr(mod, "ACTIVE_MODEL", "claude-haiku-4-5-20251001"),
+        "system": SYSTEM_PROMPT,
+        "instructions": ANALYSIS_INSTRUCTIONS,
+        "prompt_version": ANALYSIS_PROMPT_VERSION,
+    }
+    return hashlib.blake2b(_json_key(payload), digest_size=20).hexdigest()
+
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•·]+|\d+[.)])\s+", re.MULTILINE)
+
+
+def _hu_content_key(hu: dict, prev_data: dict = None) -> str:
+    """
+    Huella del contenido de la HU sin su columna ID (minúsculas, espacios colapsados, sin viñetas).
+    HUs repetidas entre hojas comparten huella y se analizan una sola vez por corrida.
+    La columna ID es la que detectó read_sheet_hus (_id_col): la misma HU puede tener otro ID
+    en otra hoja, pero otra columna con el mismo valor que el ID (ej. Fase "1") sí cuenta.
+    """
+    id_col = hu.get("_id_col")
+    parts = []
+    for k, v in hu.items():
+        if k.startswith("_") or k == id_col:
+            continue
+        text = " ".join(_BULLET_RE.sub("", str(v or "")).lower().split())
+        parts.append(f"{k.strip().lower()}={text}")
+    if prev_data:
+        parts.append(_json_key(prev_data).decode("utf-8"))
+    return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=20).hexdigest()
+
+
+def get_cached_analysis(key: str) -> dict | None:
+    """Retorna el análisis cacheado para la huella o None si no existe."""
+    path = os.path.join(_HU_CACHE_DIR, f"{key}.json")
+    try:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                result = _json_loads(f.read())
+            # Score y nivel se recalculan con los pesos activos
+            result["score_total"] = compute_total_score(result.get("scores", {}))
+            result["nivel"] = score_to_level(result["score_total"])
+            return result
+    except Exception:
+        pass
+    return None
+
+
+def save_cached_analysis(key: str, result: dict) -> None:
+    """Guarda el veredicto de Claude (sin campos internos). Los errores no se cachean."""
+    if result.get("nivel") == "⛔ Error":
+        return
+    try:
+        os.makedirs(_HU_CACHE_DIR, exist_ok=True)
+        data = {k: v for k, v in result.items() if not k.startswith("_")}
+        # Escritura atómica: archivo temporal + os.replace (un lector nunca ve un JSON a medias)
+        fd, tmp_path = tempfile.mkstemp(dir=_HU_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_json_dumps(data))
+            os.replace(tmp_path, os.path.join(_HU_CACHE_DIR, f"{key}.json"))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
     except Exception:
-        return elapsed_sec
+        pass
 
 
 def count_hus_to_analyze(input_path: str, target_sheet: str = None, limit: int = None) -> int:
@@ -96,6 +264,34 @@ try:
 except ImportError:
     MAX_CONCURRENT_ANALYSIS = 5
 
+try:
+    from config import BATCH_POLL_SECONDS
+except ImportError:
+    BATCH_POLL_SECONDS = 10
+
+try:
+    from config import HUS_PER_REQUEST
+except ImportError:
+    HUS_PER_REQUEST = 1
+
+try:
+    from config import ANALYSIS_TIMEOUT_SECONDS
+except ImportError:
+    ANALYSIS_TIMEOUT_SECONDS = 90
+
+try:
+    from config import MAX_INPUT_TOKENS_PER_MINUTE
+except ImportError:
+    MAX_INPUT_TOKENS_PER_MINUTE = 0
+
+try:
+    from config import REUSE_UNCHANGED_PREVIOUS
+except ImportError:
+    REUSE_UNCHANGED_PREVIOUS = True
+
+# Con mode="batch" y hasta estas HUs únicas se usa el modo normal (el batch no compensa la espera)
+_BATCH_FALLBACK_MAX_HUS = 4
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 1. CONSTANTES DE ESTRUCTURA DEL EXCEL
@@ -153,6 +349,16 @@ ANALYSIS_HEADERS = [
     ("COMPARACIÓN\nvs ANTERIOR",                 "44546A", 35),
 ]
 
+# Estilos de los headers de análisis: se crean una vez y se reutilizan en cada hoja
+_ANALYSIS_HEADER_FONT = Font(bold=True, color="FFFFFF", name="Arial", size=10)
+_ANALYSIS_HEADER_ALIGN = Alignment(horizontal="center", vertical="center", wrap_text=True)
+_ANALYSIS_HEADER_SIDE = Side(style="thin", color="D0D0D0")
+_ANALYSIS_HEADER_BORDER = Border(left=_ANALYSIS_HEADER_SIDE, right=_ANALYSIS_HEADER_SIDE,
+                                 top=_ANALYSIS_HEADER_SIDE, bottom=_ANALYSIS_HEADER_SIDE)
+_ANALYSIS_HEADER_FILLS = {
+    color: PatternFill("solid", start_color=color, end_color=color) for _, color, _ in ANALYSIS_HEADERS
+}
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 3. PROMPTS PARA CLAUDE
@@ -197,36 +403,12 @@ Contexto Actinver:
 Responde ÚNICAMENTE con JSON válido. Sin texto antes ni después del JSON."""
 
 
-def build_analysis_prompt(hu: dict, prev_data: dict = None) -> str:
-    # Headers = columnas del Excel (cada documento puede tener columnas distintas)
-    headers = [k for k in hu.keys() if not k.startswith("_")]
-    # Incluir TODA la fila: cada columna con su valor (vacío = "(vacío)" para que la IA vea la estructura)
-    hu_lines = []
-    for h in headers:
-        v = hu.get(h, "")
-        if v is None or (isinstance(v, str) and str(v).strip() in ("", "nan", "None")):
-            v = "(vacío)"
-        else:
-            v = str(v).strip()
-        hu_lines.append(f"  {h}: {v}")
-    hu_text = "\n".join(hu_lines)
-
-    prev_block = ""
-    if prev_data:
-        brechas_prev = prev_data.get("brechas") or {}
-        brechas_txt = " | ".join(f"{k}: {(str(v)[:60]+'...' if len(str(v))>60 else v)}" for k, v in brechas_prev.items() if v)
-        prev_block = f"""
-═══ ANÁLISIS ANTERIOR (referencia) ═══
-Score total previo: {prev_data.get('score_total', 0):.0f}/100
-Nivel previo: {prev_data.get('nivel', '')}
-Resumen previo: {str(prev_data.get('resumen', ''))[:300]}
-Brechas previas: {brechas_txt[:400]}
-══════════════════════════════════════
-COMPARA la HU actual con el análisis anterior. Ubica la HU (por ID) e identifica las MEJORAS que el PO hizo.
-Normalmente el score debería subir. Si no sube o baja, indica en comparacion_anterior qué antes estaba mejor definido.
-"""
+# Instrucciones fijas del análisis (igual para todas las HUs). Van en un bloque propio
+# ANTES del contenido de la HU para que Anthropic las cachee (prompt caching) junto con el system.
+# Subir al cambiar cómo se construye o interpreta el análisis (invalida .hu_cache/)
+ANALYSIS_PROMPT_VERSION = "2"
 
-    return f"""Analiza la siguiente Historia de Usuario de Actinver. Evalúa su
+ANALYSIS_INSTRUCTIONS = """Analiza la Historia de Usuario de Actinver que se incluye al final. Evalúa su
 DEFINICIÓN FUNCIONAL desde la perspectiva del PO (persona de negocio).
 La parte técnica se abordará en prerefinamiento — aquí solo lo funcional.
 
@@ -234,18 +416,12 @@ RECUERDA: Cada HU es una ETAPA del proceso. No esperes toda la información en c
 El flujo completo se arma con todas las HUs. Evalúa qué es razonable para ESTA etapa
 (no penalices por info que puede estar en otra etapa posterior o anterior).
 
-═══ HISTORIA DE USUARIO ═══
-Columnas de este documento: {", ".join(headers)}
-
 CRÍTICO — LEE EL CONTENIDO DE CADA COLUMNA (no solo los headers):
 - Cada celda puede tener información. DEBES leer el texto de cada columna antes de evaluar.
 - Si una columna se llama "Mensajes de Error", "Mensaje de error" o similar y tiene contenido → mensajes de error SÍ definidos.
 - Si "Reglas de Negocio", "Flujos Alternos", "Criterios de Aceptación", etc. tienen texto → usa ese contenido.
 - NO indiques "falta X" si la columna correspondiente tiene contenido. Verifica el valor de cada celda.
 
-{hu_text}
-═══════════════════════════
-{prev_block}
 Evalúa las 6 dimensiones (score 0-10) desde lo que el PO debe definir:
 
 1. DEFINICIÓN FUNCIONAL (35%): (a) Mensajes de error, (b) Flujos alternos, (c) Medición/monitoreo.
@@ -274,35 +450,134 @@ Evalúa las 6 dimensiones (score 0-10) desde lo que el PO debe definir:
 IMPORTANTE: En los campos de texto (resumen, brechas, etc.) NO uses comillas dobles (") dentro de las cadenas; usa comillas simples o evita las comillas para que el JSON sea válido.
 
 Responde SOLO con este JSON exacto (sin markdown, sin bloques ```, sin texto extra):
-{{
-  "scores": {{
+{
+  "scores": {
     "funcional": <0-10>,
     "capas_tec": <0-10>,
     "ux_ui": <0-10>,
     "integraciones": <0-10>,
     "regulatorio": <0-10>,
     "criterios": <0-10>
-  }},
+  },
   "capas_tecnologicas": "<lista de capas involucradas separadas por | ej: UI | Backend | RENAPO | Notificaciones>",
   "resumen": "<2 oraciones constructivas: nivel de definición funcional y qué falta definir para prerefinamiento>",
-  "brechas": {{
+  "brechas": {
     "funcional":  "<qué conviene que el PO defina en esta dimensión | o 'Completo' si está listo>",
     "capas_tec":  "<qué capas conviene que el PO identifique | o 'Completo'>",
     "ux_ui":      "<qué conviene definir en UX/UI | o 'Completo'>",
     "integraciones": "<qué sistemas conviene identificar | o 'Completo'>",
     "regulatorio": "<qué aspectos regulatorios conviene identificar | o 'Completo'>",
     "criterios":   "<qué criterios conviene definir | o 'Completo'>"
-  }},
+  },
   "preguntas_criticas": "<3-5 preguntas amigables para que el PO clarifique antes del prerefinamiento, separadas por |>",
   "mejoras_identificadas": "<si hay análisis anterior: mejoras que el PO hizo a la HU, separadas por |. Si no hay anterior: 'N/A'>",
   "comparacion_anterior": "<si hay análisis anterior y el score bajó: 'Anteriormente estaba mejor definido en: [aspectos]'. Si subió o no hay anterior: 'N/A'>"
-}}
+}
 
 En "brechas": escribe QUÉ DEBE DEFINIR el PO para esta etapa, en tono constructivo.
 No pidas info que corresponda a otras etapas del flujo. Si para esta etapa está completo: "Completo".
 Si hay análisis anterior: en "mejoras_identificadas" lista las mejoras; en "comparacion_anterior" solo escribe algo si el score BAJÓ respecto al anterior."""
 
 
+def _cached_text_block(text: str) -> dict:
+    """Bloque de texto marcado como breakpoint de prompt caching (TTL ~5 min en Anthropic)."""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+@lru_cache(maxsize=8)
+def _system_blocks_for(text: str) -> list[dict]:
+    """Bloques del system prompt, armados una vez por texto (app.py cambia SYSTEM_PROMPT por versión)."""
+    return [_cached_text_block(text)]
+
+
+def _system_blocks(system_prompt) -> list[dict]:
+    """
+    System prompt en formato de bloques cacheables.
+    Acepta un string (SYSTEM_PROMPT) o una lista de bloques ya armada.
+    """
+    if isinstance(system_prompt, list):
+        return system_prompt
+    return _system_blocks_for(system_prompt)
+
+
+# Bloque fijo de instrucciones: el mismo objeto en cada llamada
+_ANALYSIS_INSTRUCTIONS_BLOCK = _cached_text_block(ANALYSIS_INSTRUCTIONS)
+
+_PREV_BLOCK_HEADER = "\n═══ ANÁLISIS ANTERIOR (referencia) ═══\n"
+_PREV_BLOCK_FOOTER = (
+    "══════════════════════════════════════\n"
+    "COMPARA la HU actual con el análisis anterior. Ubica la HU (por ID) e identifica las MEJORAS que el PO hizo.\n"
+    "Normalmente el score debería subir. Si no sube o baja, indica en comparacion_anterior qué antes estaba mejor definido.\n"
+)
+_HU_BLOCK_HEADER = "═══ HISTORIA DE USUARIO ═══\nColumnas de este documento: "
+_HU_BLOCK_FOOTER = "\n═══════════════════════════\n"
+
+
+def _hu_prompt_text(hu: dict, prev_data: dict = None) -> str:
+    """Parte dinámica del prompt: la HU (todas sus columnas) y su análisis anterior si existe."""
+    # Headers = columnas del Excel (cada documento puede tener columnas distintas)
+    headers = [k for k in hu.keys() if not k.startswith("_")]
+    # Incluir TODA la fila: cada columna con su valor (vacío = "(vacío)" para que la IA vea la estructura)
+    parts = [_HU_BLOCK_HEADER, ", ".join(headers), "\n\n"]
+    hu_lines = []
+    for h in headers:
+        v = hu.get(h, "")
+        if v is None or (isinstance(v, str) and str(v).strip() in ("", "nan", "None")):
+            v = "(vacío)"
+        else:
+            v = str(v).strip()
+        hu_lines.append(f"  {h}: {v}")
+    parts.append("\n".join(hu_lines))
+    parts.append(_HU_BLOCK_FOOTER)
+
+    if prev_data:
+        brechas_prev = prev_data.get("brechas") or {}
+        brechas_txt = " | ".join(f"{k}: {(str(v)[:60]+'...' if len(str(v))>60 else v)}" for k, v in brechas_prev.items() if v)
+        parts += [
+            _PREV_BLOCK_HEADER,
+            f"Score total previo: {prev_data.get('score_total', 0):.0f}/100\n",
+            f"Nivel previo: {prev_data.get('nivel', '')}\n",
+            f"Resumen previo: {str(prev_data.get('resumen', ''))[:300]}\n",
+            f"Brechas previas: {brechas_txt[:400]}\n",
+            _PREV_BLOCK_FOOTER,
+        ]
+    return "".join(parts)
+
+
+def build_analysis_prompt(hu: dict, prev_data: dict = None) -> list[dict]:
+    """
+    Construye el contenido del mensaje de usuario como bloques:
+      1. ANALYSIS_INSTRUCTIONS (fijo, cacheable)
+      2. La HU y el análisis anterior (dinámico)
+    """
+    return [_ANALYSIS_INSTRUCTIONS_BLOCK, {"type": "text", "text": _hu_prompt_text(hu, prev_data)}]
+
+
+# Instrucciones para varias HUs en un mismo mensaje (HUS_PER_REQUEST > 1)
+BATCH_ANALYSIS_INSTRUCTIONS = """HISTORIAS DE USUARIO (lote): a continuación vienen varias HUs numeradas
+(HU #1, HU #2, ...). Analiza CADA una por separado, con las instrucciones anteriores,
+como si fuera la única HU del mensaje (su análisis anterior, si lo tiene, viene junto a ella).
+
+Responde SOLO con este JSON (sin markdown, sin texto extra):
+{"results": [<JSON de la HU #1>, <JSON de la HU #2>, ...]}
+Un objeto por HU, en el mismo orden y con exactamente el formato indicado arriba."""
+
+_BATCH_INSTRUCTIONS_BLOCK = _cached_text_block(BATCH_ANALYSIS_INSTRUCTIONS)
+
+
+def build_batch_analysis_prompt(hus: list[dict], prevs: list[dict | None]) -> list[dict]:
+    """
+    Contenido del mensaje de usuario para analizar varias HUs en una sola llamada:
+      1. ANALYSIS_INSTRUCTIONS y BATCH_ANALYSIS_INSTRUCTIONS (fijos, cacheables)
+      2. Las HUs numeradas, cada una con su análisis anterior (dinámico)
+    """
+    parts = [f"Total de HUs en este lote: {len(hus)}\n"]
+    for n, (hu, prev) in enumerate(zip(hus, prevs), 1):
+        parts.append(f"\n─── HU #{n} ───\n")
+        parts.append(_hu_prompt_text(hu, prev))
+    return [_ANALYSIS_INSTRUCTIONS_BLOCK, _BATCH_INSTRUCTIONS_BLOCK, {"type": "text", "text": "".join(parts)}]
+
+
 EXECUTIVE_ANALYSIS_PROMPT = """Eres el analista de HUs de Productos Digitales Actinver. Te encuentras en el elevador con un líder que te pregunta: "¿Cómo van las iniciativas de cada PO?"
 
 Tienes el resumen del análisis de HUs por iniciativa. Para CADA iniciativa debes escribir UN párrafo corto (3-5 oraciones) que:
@@ -332,10 +607,26 @@ Formato de respuesta:
 # 4. OUTPUT CON VERSIONADO
 # ══════════════════════════════════════════════════════════════════════════════
 
+_OUTPUT_VERSION_LOCK = threading.Lock()
+
+
+def _scan_output_version(output_dir: str, base: str, ext: str) -> int:
+    """Mayor versión vN.0 existente en Output/ para base+ext (0 si no hay)."""
+    pattern = re.compile(rf"^{re.escape(base)}_analizado_v(\d+)\.0{re.escape(ext)}$")
+    max_v = 0
+    for f in os.listdir(output_dir):
+        m = pattern.match(f)
+        if m:
+            max_v = max(max_v, int(m.group(1)))
+    return max_v
+
+
 def get_next_output_path(input_path: str, original_filename: str = None) -> str:
     """
     Genera ruta en Output/ con numeración consecutiva v1.0, v2.0, v3.0...
     original_filename: nombre original para upload (ej: HUs_Compilado.xlsx)
+    La última versión se guarda en Output/.<nombre>.version: cada llamada reserva la siguiente
+    sin listar la carpeta. Solo se escanea Output/ si ese archivo falta o quedó atrasado.
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     output_dir = os.path.join(script_dir, OUTPUT_DIR)
@@ -347,16 +638,24 @@ def get_next_output_path(input_path: str, original_filename: str = None) -> str:
     else:
         base = os.path.splitext(os.path.basename(input_path))[0]
         ext = os.path.splitext(input_path)[1] or ".xlsx"
-    pattern = re.compile(rf"^{re.escape(base)}_analizado_v(\d+)\.0{re.escape(ext)}$")
 
-    max_v = 0
-    if os.path.isdir(output_dir):
-        for f in os.listdir(output_dir):
-            m = pattern.match(f)
-            if m:
-                max_v = max(max_v, int(m.group(1)))
+    ver_file = os.path.join(output_dir, f".{base}{ext}.version")
+    with _OUTPUT_VERSION_LOCK, open(ver_file, "a+", encoding="utf-8") as vf:
+        if fcntl is not None:
+            fcntl.flock(vf, fcntl.LOCK_EX)  # se libera al cerrar el archivo
+        vf.seek(0)
+        try:
+            last_v = int(vf.read().strip())
+        except ValueError:
+            last_v = _scan_output_version(output_dir, base, ext)
+        next_v = last_v + 1
+        if os.path.exists(os.path.join(output_dir, f"{base}_analizado_v{next_v}.0{ext}")):
+            # Versión de archivo atrasada (ej. outputs copiados a mano): recuperar desde la carpeta
+            next_v = max(last_v, _scan_output_version(output_dir, base, ext)) + 1
+        vf.seek(0)
+        vf.truncate()
+        vf.write(str(next_v))
 
-    next_v = max_v + 1
     filename = f"{base}_analizado_v{next_v}.0{ext}"
     return os.path.join(output_dir, filename)
 
@@ -367,41 +666,40 @@ def get_next_output_path(input_path: str, original_filename: str = None) -> str:
 
 # Pistas para detectar fila de encabezados (hojas con estructura distinta)
 HEADER_HINTS = ("id", "no. hu", "no hu", "titulo", "título", "descripción", "descripcion", "historia")
+_HEADER_HINTS_RE = re.compile("|".join(map(re.escape, HEADER_HINTS)))  # una búsqueda por fila
+
+# Encabezados reconocidos (comparación exacta en minúsculas)
+_ID_HEADERS = frozenset({"id", "no. hu", "no hu", "hu-id", "hu id", "código", "codigo"})
+_TITLE_HEADERS = frozenset({"titulo", "título", "title"})
+_DESC_HEADERS = frozenset({"descripcion", "descripción", "description", "definicion", "definición", "definición funcional"})
 
 def _detect_header_row(ws) -> int:
     """Detecta la fila de encabezados escaneando las primeras 15 filas."""
-    max_scan = min(16, getattr(ws, "max_row", 100) + 1)
-    for row_idx in range(1, max_scan):
-        try:
-            row = ws[row_idx]
-            cells = [str(c.value or "").strip().lower() for c in list(row)[:10]]
-        except (TypeError, AttributeError):
-            # read_only: usar iter_rows
-            rows = list(ws.iter_rows(min_row=row_idx, max_row=row_idx, max_col=10))
-            cells = [str(c.value or "").strip().lower() for c in rows[0]] if rows else []
-        if any(h in " ".join(cells) for h in HEADER_HINTS):
+    # iter_rows(values_only) funciona igual en modo normal y read_only. En modo normal se acota a
+    # max_row/max_column (iter_rows crea las celdas que recorre y agrandaría la hoja); en read_only
+    # no, porque las dimensiones declaradas en el archivo pueden faltar o estar mal.
+    if isinstance(ws, ReadOnlyWorksheet):
+        max_row, max_col = 15, 10
+    else:
+        max_row = min(15, ws.max_row or 15)
+        max_col = min(10, ws.max_column or 10)
+    for row_idx, row in enumerate(ws.iter_rows(min_row=1, max_row=max_row, max_col=max_col, values_only=True), 1):
+        joined = " ".join(str(v or "").strip().lower() for v in row)
+        if _HEADER_HINTS_RE.search(joined):
             return row_idx
     return HEADER_ROW
 
 def _find_id_column(headers: list[str]) -> int:
     """Encuentra el índice de la columna ID."""
-    for i, h in enumerate(headers):
-        h_lower = (h or "").strip().lower()
-        if h_lower in ("id", "no. hu", "no hu", "hu-id", "hu id", "código", "codigo"):
-            return i
-    return 0
+    return _scan_header_columns(headers)["id"]
 
 
 # Nombres de columna que indican Fase 1 / MVP (MVP = Fase 1)
-MVP_FASE_HEADERS = ("fase", "fase 1", "mvp", "fase/mvp", "fase 1 / mvp", "alcance mvp", "alcance")
+MVP_FASE_HEADERS = frozenset({"fase", "fase 1", "mvp", "fase/mvp", "fase 1 / mvp", "alcance mvp", "alcance"})
 
 def _find_mvp_fase_column(headers: list[str]) -> int | None:
     """Encuentra la columna que indica si la HU va en Fase 1 o MVP. Retorna índice o None."""
-    for i, h in enumerate(headers):
-        h_lower = (h or "").strip().lower()
-        if h_lower in MVP_FASE_HEADERS or "mvp" in h_lower or "fase 1" in h_lower:
-            return i
-    return None
+    return _scan_header_columns(headers)["mvp"]
 
 
 def _is_mvp_value(val) -> bool:
@@ -419,6 +717,10 @@ def _is_mvp_value(val) -> bool:
     return False
 
 
+_HU_ID_RE = re.compile(r"HU[-_]?\s*(\d+)", re.I)
+_LEAD_DIGITS_RE = re.compile(r"^(\d+)")
+
+
 def _normalize_hu_id(hu_id: str) -> str:
     """
     Normaliza ID para matching flexible: HU-001, HU-1, 001, 1, 1.0 -> hu_1.
@@ -430,10 +732,10 @@ def _normalize_hu_id(hu_id: str) -> str:
     # Excel puede devolver 1.0 en vez de "HU-001"
     if s.replace(".", "").isdigit():
         return f"hu_{int(float(s))}"
-    m = re.search(r"HU[-_]?\s*(\d+)", s, re.I)
+    m = _HU_ID_RE.search(s)
     if m:
         return f"hu_{int(m.group(1))}"
-    m = re.search(r"^(\d+)", s)
+    m = _LEAD_DIGITS_RE.match(s)
     if m:
         return f"hu_{int(m.group(1))}"
     return s.lower()
@@ -454,32 +756,102 @@ def _normalize_content(text: str, max_len: int = 300) -> str:
 
 def _find_title_column(headers: list[str]) -> int:
     """Encuentra el índice de la columna Título."""
-    for i, h in enumerate(headers):
-        h_lower = (h or "").strip().lower()
-        if h_lower in ("titulo", "título", "title"):
-            return i
-    return 1  # fallback: columna B típica
+    return _scan_header_columns(headers)["title"]
 
 
 def _find_desc_column(headers: list[str]) -> int:
     """Encuentra el índice de la columna Descripción o Definición."""
+    return _scan_header_columns(headers)["desc"]
+
+
+def _scan_header_columns(headers: list[str]) -> dict:
+    """
+    Ubica en una sola pasada las columnas conocidas de una hoja (primera coincidencia de cada una):
+      - "id" (fallback 0), "title" (fallback 1, columna B típica), "desc" (fallback 2, columna C típica)
+      - "mvp": columna Fase 1 / MVP, o None
+      - "score_start": columna SCORE TOTAL del análisis (hojas ya analizadas), o None
+    """
+    found = {"id": None, "title": None, "desc": None, "mvp": None, "score_start": None}
     for i, h in enumerate(headers):
         h_lower = (h or "").strip().lower()
-        if h_lower in ("descripcion", "descripción", "description", "definicion", "definición", "definición funcional"):
-            return i
-    return 2  # fallback: columna C típica
+        if not h_lower:
+            continue
+        if found["id"] is None and h_lower in _ID_HEADERS:
+            found["id"] = i
+        if found["title"] is None and h_lower in _TITLE_HEADERS:
+            found["title"] = i
+        if found["desc"] is None and h_lower in _DESC_HEADERS:
+            found["desc"] = i
+        if found["mvp"] is None and (h_lower in MVP_FASE_HEADERS or "mvp" in h_lower or "fase 1" in h_lower):
+            found["mvp"] = i
+        if found["score_start"] is None and "score" in h_lower and "total" in h_lower:
+            found["score_start"] = i
+    for key, fallback in (("id", 0), ("title", 1), ("desc", 2)):
+        if found[key] is None:
+            found[key] = fallback
+    return found
+
+
+def _row_value(row: tuple, idx: int):
+    """Valor de la celda idx de una fila de iter_rows(values_only=True); None si la fila es más corta."""
+    return row[idx] if idx < len(row) else None
 
 
 def _similarity(a: str, b: str) -> float:
-    """Ratio de similitud 0-1 entre dos strings."""
+    """Ratio de similitud 0-1 entre dos strings (rapidfuzz si está instalado, si no difflib)."""
     if not a or not b:
         return 0.0
+    if _rf_fuzz is not None:
+        return _rf_fuzz.ratio(a, b) / 100.0
     return difflib.SequenceMatcher(None, a, b).ratio()
 
+
+def _combined_similarity(a_title: str, b_title: str, a_desc: str, b_desc: str, threshold: float) -> float:
+    """
+    Score combinado 0.6·título + 0.4·contenido (mismo valor que con _similarity).
+    Antes de ratio() prueba las cotas superiores baratas de difflib (real_quick_ratio ≥ quick_ratio ≥ ratio):
+    si la cota ya no alcanza threshold retorna 0.0 sin hacer el matching completo.
+    Con rapidfuzz: si el título solo, con el contenido al 100%, no alcanza threshold, no se compara el contenido.
+    """
+    if _rf_fuzz is not None:
+        has_desc = bool(a_desc and b_desc)
+        t = _rf_fuzz.ratio(a_title, b_title) / 100.0 if a_title and b_title else 0.0
+        if 0.6 * t + 0.4 * has_desc < threshold:
+            return 0.0
+        return 0.6 * t + (0.4 * _rf_fuzz.ratio(a_desc, b_desc) / 100.0 if has_desc else 0.0)
+
+    t = difflib.SequenceMatcher(None, a_title, b_title) if a_title and b_title else None
+    d = difflib.SequenceMatcher(None, a_desc, b_desc) if a_desc and b_desc else None
+    if t is None and d is None:
+        return 0.0
+    for bound in ("real_quick_ratio", "quick_ratio"):
+        upper = 0.6 * (getattr(t, bound)() if t else 0) + 0.4 * (getattr(d, bound)() if d else 0)
+        if upper < threshold:
+            return 0.0
+    return 0.6 * (t.ratio() if t else 0) + 0.4 * (d.ratio() if d else 0)
+
+_WORD_RE = re.compile(r"\w{3,}")
+
+
+def _content_tokens(norm_title: str, norm_desc: str) -> frozenset:
+    """Palabras (3+ letras) de título + contenido normalizados, para el tier de palabras en común."""
+    return frozenset(_WORD_RE.findall(f"{norm_title} {norm_desc}"))
+
+
+def _token_similarity(a: frozenset, b: frozenset) -> float:
+    """Jaccard 0-1 entre conjuntos de palabras: tolera orden distinto y redacción reescrita."""
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
 def get_sheet_headers(ws) -> list[str]:
     """Obtiene la lista de encabezados de una hoja (para usar como formato común)."""
     header_row = _detect_header_row(ws)
-    return [str(cell.value or "").strip() for cell in ws[header_row]]
+    for row in ws.iter_rows(min_row=header_row, max_row=header_row, values_only=True):
+        return [str(v or "").strip() for v in row]
+    return []
 
 
 def get_common_headers_from_excel(excel_path: str) -> list[str]:
@@ -487,74 +859,145 @@ def get_common_headers_from_excel(excel_path: str) -> list[str]:
     Obtiene los encabezados comunes del Excel base (primera hoja con datos).
     Usado para que las hojas de Word coincidan con el formato de las iniciativas existentes.
     """
-    wb = openpyxl.load_workbook(excel_path)
-    for sheet_name in wb.sheetnames:
-        if sheet_name == "📊 Síntesis Ejecutiva":
-            continue
-        ws = wb[sheet_name]
-        headers = get_sheet_headers(ws)
-        if headers and any(h for h in headers):
-            return [h for h in headers if h]
-    return []
+    wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        for sheet_name in wb.sheetnames:
+            if sheet_name == "📊 Síntesis Ejecutiva":
+                continue
+            ws = wb[sheet_name]
+            headers = get_sheet_headers(ws)
+            if headers and any(h for h in headers):
+                return [h for h in headers if h]
+        return []
+    finally:
+        wb.close()
+
+
+def _set_norm_keys(hu: dict) -> dict:
+    """
+    Guarda en la HU su ID, título y descripción normalizados (_norm_id, _norm_title, _norm_desc)
+    para que el matching con el análisis anterior no los recalcule en cada comparación.
+    """
+    hu["_norm_id"] = _normalize_hu_id(hu["_hu_id"])
+    hu["_norm_title"] = _normalize_title(hu.get("Titulo") or hu.get("Titulo ", ""))
+    hu["_norm_desc"] = _normalize_content(hu.get("Descripción") or hu.get("Descripcion")
+                                          or hu.get("Definición") or hu.get("Definicion") or "")
+    return hu
 
 
-def read_sheet_hus(ws, sheet_name: str) -> list[dict]:
+def read_sheet_hus(ws, sheet_name: str, header_row: int = None) -> list[dict]:
     """Lee todas las HUs válidas de una hoja. Detecta header row si la hoja tiene estructura distinta."""
-    header_row = _detect_header_row(ws)
-    headers = [
-        str(cell.value).strip() if cell.value else ""
-        for cell in ws[header_row]
-    ]
-    id_col = _find_id_column(headers)
-    mvp_col = _find_mvp_fase_column(headers)
-    data_start = header_row + 1
+    if header_row is None:
+        header_row = _detect_header_row(ws)
+    rows = ws.iter_rows(min_row=header_row, values_only=True)
+    header_values = next(rows, ())
+    # Nombre de hoja y headers internados: se repiten como valor/clave en cada HU de la hoja
+    sheet_name = sys.intern(sheet_name)
+    headers = [sys.intern(str(v).strip()) if v else "" for v in header_values]
+    cols = _scan_header_columns(headers)
+    id_col, mvp_col = cols["id"], cols["mvp"]
+    id_header = headers[id_col] if id_col < len(headers) else ""
+    # (índice, header) de las columnas con nombre, calculado una vez por hoja
+    fields = [(col_idx, header) for col_idx, header in enumerate(headers) if header]
 
     hus = []
-    for row_idx in range(data_start, ws.max_row + 1):
-        row = ws[row_idx]
-        hu_id = str(row[id_col].value).strip() if row[id_col].value else ""
+    for row_idx, row in enumerate(rows, header_row + 1):
+        n_cells = len(row)
+        raw_id = row[id_col] if id_col < n_cells else None
+        hu_id = str(raw_id).strip() if raw_id else ""
         if hu_id in SKIP_VALUES or not hu_id:
             continue
 
-        hu = {"_sheet": sheet_name, "_row": row_idx, "_hu_id": hu_id}
-        for col_idx, header in enumerate(headers):
-            if header:
-                val = row[col_idx].value if col_idx < len(row) else None
-                hu[header] = str(val).strip() if val else ""
+        hu = {"_sheet": sheet_name, "_row": row_idx, "_hu_id": hu_id, "_id_col": id_header}
+        for col_idx, header in fields:
+            val = row[col_idx] if col_idx < n_cells else None
+            hu[header] = str(val).strip() if val else ""
         # MVP/Fase 1: si existe columna, solo las marcadas cuentan para overall; si no existe, todas
         if mvp_col is not None:
-            val = row[mvp_col].value if mvp_col < len(row) else None
+            val = row[mvp_col] if mvp_col < n_cells else None
             hu["_is_mvp"] = _is_mvp_value(val)
         else:
             hu["_is_mvp"] = True  # Sin columna MVP: todas cuentan (retrocompat)
-        hus.append(hu)
+        hus.append(_set_norm_keys(hu))
 
     return hus
 
 
-def load_all_hus(filepath: str, target_sheet: str = None, quiet: bool = False) -> tuple[dict, list]:
-    """Carga HUs de todas las hojas (o solo la especificada)."""
+# Carga de hojas en paralelo (un proceso por hoja): solo compensa en Excels grandes con varias hojas
+_PARALLEL_LOAD_MIN_SHEETS = 3
+_PARALLEL_LOAD_MIN_BYTES = 1 * 1024 * 1024
+
+
+def _load_one_sheet(args: tuple[str, str]) -> tuple[str, int, list[dict]]:
+    """Worker de ProcessPoolExecutor: abre su propio workbook read-only y lee una hoja."""
+    filepath, sheet_name = args
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        hdr = _detect_header_row(ws)
+        return sheet_name, hdr, read_sheet_hus(ws, sheet_name, header_row=hdr)
+    finally:
+        wb.close()
+
+
+def _load_sheets_parallel(filepath: str, sheets: list[str]) -> list[tuple[str, int, list[dict]]] | None:
+    """
+    Lee varias hojas en procesos separados (openpyxl no suelta el GIL, los hilos no ayudan).
+    Usa "spawn": run() puede estar en un hilo (Streamlit) y fork con hilos activos es inseguro.
+    Retorna None si el pool falla, para que el llamador lea en secuencia.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(sheets), os.cpu_count()),
+                                 mp_context=multiprocessing.get_context("spawn")) as ex:
+            return list(ex.map(_load_one_sheet, [(filepath, name) for name in sheets]))
+    except Exception:
+        return None
+
+
+def load_all_hus(filepath: str, target_sheet: str = None, quiet: bool = False,
+                 read_only: bool = True) -> tuple[dict, list]:
+    """
+    Carga HUs de todas las hojas (o solo la especificada).
+    read_only=True (default) abre el Excel en modo streaming y solo valores: no instancia
+    celdas ni estilos. La escritura del resultado recarga el archivo en modo normal.
+    Con varias hojas en un archivo grande, cada hoja se lee en su propio proceso.
+    """
     def _log(msg):
         if not quiet:
             print(msg)
 
-    wb = openpyxl.load_workbook(filepath)
+    wb = openpyxl.load_workbook(filepath, read_only=read_only, data_only=read_only)
     sheets_data = {}
     all_hus = []
 
-    sheets = [target_sheet] if target_sheet else wb.sheetnames
-    for sheet_name in sheets:
+    sheets = []
+    for sheet_name in ([target_sheet] if target_sheet else wb.sheetnames):
         if sheet_name not in wb.sheetnames:
             _log(f"  ⚠  Hoja '{sheet_name}' no encontrada, se omite.")
             continue
-        ws = wb[sheet_name]
-        hus = read_sheet_hus(ws, sheet_name)
+        sheets.append(sheet_name)
+
+    loaded = None
+    if (read_only and isinstance(filepath, str) and len(sheets) >= _PARALLEL_LOAD_MIN_SHEETS
+            and (os.cpu_count() or 1) > 1 and os.path.getsize(filepath) >= _PARALLEL_LOAD_MIN_BYTES):
+        loaded = _load_sheets_parallel(filepath, sheets)
+    if loaded is None:
+        loaded = []
+        for sheet_name in sheets:
+            ws = wb[sheet_name]
+            hdr = _detect_header_row(ws)
+            loaded.append((sheet_name, hdr, read_sheet_hus(ws, sheet_name, header_row=hdr)))
+
+    for sheet_name, hdr, hus in loaded:
         sheets_data[sheet_name] = hus
         all_hus.extend(hus)
-        hdr = _detect_header_row(ws)
         extra = f" (headers fila {hdr})" if hdr != HEADER_ROW else ""
         _log(f"  📋  {sheet_name}: {len(hus)} HUs cargadas{extra}")
 
+    if read_only:
+        wb.close()
     return sheets_data, all_hus
 
 
@@ -563,16 +1006,20 @@ def load_previous_analysis(filepath: str, log_fn=None) -> dict:
     Carga el análisis previo desde un Excel ya analizado.
     Retorna dict con:
       - "by_id": (sheet, norm_id) -> prev_data
-      - "by_sheet": sheet -> list of {prev, norm_title, norm_desc}
+      - "by_title": (sheet, norm_title) -> prev_data (primera HU con ese título)
+      - "by_sheet": sheet -> {"titles": [...], "descs": [...], "tokens": [...], "prevs": [...]} (listas paralelas)
+      - "by_content": huella de contenido (_hu_content_key) -> análisis completo reutilizable
 
-    Matching: 1) ID, 2) título exacto, 3) título + contenido similar.
+    Matching: 1) ID, 2) título exacto, 3) título + contenido similar, 4) palabras en común.
     """
     def _log(msg):
         if log_fn:
             log_fn(msg)
 
     prev_by_id: dict[tuple[str, str], dict] = {}
-    prev_by_sheet: dict[str, list] = {}
+    prev_by_title: dict[tuple[str, str], dict] = {}
+    prev_by_sheet: dict[str, dict[str, list]] = {}
+    prev_by_content: dict[str, dict] = {}
     wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
 
     for sheet_name in wb.sheetnames:
@@ -580,64 +1027,53 @@ def load_previous_analysis(filepath: str, log_fn=None) -> dict:
             continue
         ws = wb[sheet_name]
         header_row = _detect_header_row(ws)
-        headers = [str(c.value or "").strip() for c in ws[header_row]]
-        id_col = _find_id_column(headers)
-        title_col = _find_title_column(headers)
-        desc_col = _find_desc_column(headers)
-        data_start = header_row + 1
-        # Buscar columna de inicio del análisis (SCORE TOTAL)
-        start_col = None
-        for i, h in enumerate(headers):
-            if "SCORE" in (h or "").upper() and "TOTAL" in (h or "").upper():
-                start_col = i
-                break
+        rows = ws.iter_rows(min_row=header_row, values_only=True)
+        headers = [str(v or "").strip() for v in next(rows, ())]
+        cols = _scan_header_columns(headers)
+        id_col, title_col, desc_col = cols["id"], cols["title"], cols["desc"]
+        # Columna de inicio del análisis (SCORE TOTAL); el orden de las demás es el de ANALYSIS_HEADERS
+        start_col = cols["score_start"]
         if start_col is None:
             _log(f"  ⚠  {sheet_name}: no se encontró columna SCORE TOTAL, se omite")
             continue
+        # Columnas originales de la HU (antes de la separadora azul), como las arma read_sheet_hus
+        hu_fields = [(i, h) for i, h in enumerate(headers[:start_col - 1]) if h]
+        id_header = headers[id_col] if id_col < len(headers) else ""  # excluida de _hu_content_key
 
         count = 0
-        prev_by_sheet[sheet_name] = []
-        for row_idx in range(data_start, ws.max_row + 1):
-            row = ws[row_idx]
-            raw_id = row[id_col].value
-            hu_id = str(raw_id or "").strip()
+        titles, descs, tokens, prevs = [], [], [], []
+        prev_by_sheet[sheet_name] = {"titles": titles, "descs": descs, "tokens": tokens, "prevs": prevs}
+        for row in rows:
+            hu_id = str(_row_value(row, id_col) or "").strip()
             if hu_id in SKIP_VALUES or not hu_id:
                 continue
             norm_id = _normalize_hu_id(hu_id)
             if not norm_id:
                 continue
-            try:
-                title = str(row[title_col].value or "").strip()
-            except (IndexError, AttributeError, TypeError):
-                title = ""
-            try:
-                desc = str(row[desc_col].value or "").strip()
-            except (IndexError, AttributeError, TypeError):
-                desc = ""
-            norm_title = _normalize_title(title)
-            norm_desc = _normalize_content(desc)
+            norm_title = _normalize_title(str(_row_value(row, title_col) or "").strip())
+            norm_desc = _normalize_content(str(_row_value(row, desc_col) or "").strip())
 
             try:
-                score_tot = float(row[start_col].value or 0)
+                score_tot = float(_row_value(row, start_col) or 0)
             except (ValueError, TypeError):
                 score_tot = 0
-            nivel = str(row[start_col + 1].value or "")
+            nivel = str(_row_value(row, start_col + 1) or "")
             scores = {
-                "funcional": _safe_float(row[start_col + 2]),
-                "capas_tec": _safe_float(row[start_col + 3]),
-                "ux_ui": _safe_float(row[start_col + 4]),
-                "integraciones": _safe_float(row[start_col + 5]),
-                "regulatorio": _safe_float(row[start_col + 6]),
-                "criterios": _safe_float(row[start_col + 7]),
+                "funcional": _safe_float(_row_value(row, start_col + 2)),
+                "capas_tec": _safe_float(_row_value(row, start_col + 3)),
+                "ux_ui": _safe_float(_row_value(row, start_col + 4)),
+                "integraciones": _safe_float(_row_value(row, start_col + 5)),
+                "regulatorio": _safe_float(_row_value(row, start_col + 6)),
+                "criterios": _safe_float(_row_value(row, start_col + 7)),
             }
-            resumen = str(row[start_col + 10].value or "")
+            resumen = str(_row_value(row, start_col + 9) or "")
             brechas = {
-                "funcional": str(row[start_col + 11].value or ""),
-                "capas_tec": str(row[start_col + 12].value or ""),
-                "ux_ui": str(row[start_col + 13].value or ""),
-                "integraciones": str(row[start_col + 14].value or ""),
-                "regulatorio": str(row[start_col + 15].value or ""),
-                "criterios": str(row[start_col + 16].value or ""),
+                "funcional": str(_row_value(row, start_col + 10) or ""),
+                "capas_tec": str(_row_value(row, start_col + 11) or ""),
+                "ux_ui": str(_row_value(row, start_col + 12) or ""),
+                "integraciones": str(_row_value(row, start_col + 13) or ""),
+                "regulatorio": str(_row_value(row, start_col + 14) or ""),
+                "criterios": str(_row_value(row, start_col + 15) or ""),
             }
             prev_data = {
                 "score_total": score_tot,
@@ -647,33 +1083,71 @@ def load_previous_analysis(filepath: str, log_fn=None) -> dict:
                 "brechas": brechas,
             }
             prev_by_id[(sheet_name, norm_id)] = prev_data
-            prev_by_sheet[sheet_name].append({
-                "prev": prev_data,
-                "norm_title": norm_title,
-                "norm_desc": norm_desc,
-            })
+            if score_tot > 0:  # las filas con error no se reutilizan
+                hu_like = {"_hu_id": hu_id, "_id_col": id_header}
+                for i, h in hu_fields:
+                    val = _row_value(row, i)
+                    hu_like[h] = str(val).strip() if val else ""
+                prev_by_content.setdefault(_hu_content_key(hu_like), {
+                    "scores": scores,
+                    "capas_tecnologicas": _unfmt_lines(_row_value(row, start_col + 8), "▸"),
+                    "resumen": resumen,
+                    "brechas": {d: "Completo" if v.startswith("✅") else _unfmt_lines(v, "•")
+                                for d, v in brechas.items()},
+                    "preguntas_criticas": _unfmt_lines(_row_value(row, start_col + 16), "❓"),
+                })
+            if norm_title:
+                prev_by_title.setdefault((sheet_name, norm_title), prev_data)
+            titles.append(norm_title)
+            descs.append(norm_desc)
+            tokens.append(_content_tokens(norm_title, norm_desc))
+            prevs.append(prev_data)
             count += 1
         _log(f"  📜  {sheet_name}: {count} HUs de referencia cargadas")
     wb.close()
-    return {"by_id": prev_by_id, "by_sheet": prev_by_sheet}
+    return {"by_id": prev_by_id, "by_title": prev_by_title, "by_sheet": prev_by_sheet,
+            "by_content": prev_by_content}
+
+
+def _unfmt_lines(text, bullet: str) -> str:
+    """Inverso de los _fmt_* ("• a\n• b" → "a | b") para reutilizar celdas de un análisis anterior."""
+    lines = (ln.strip() for ln in str(text or "").splitlines())
+    return " | ".join(ln[len(bullet):].strip() if ln.startswith(bullet) else ln for ln in lines if ln)
+
+
+def _reuse_previous_result(prev_result: dict) -> dict:
+    """Resultado para una HU sin cambios: el análisis anterior con score y nivel recalculados."""
+    result = {
+        "scores": {d: int(v) if float(v).is_integer() else v for d, v in prev_result["scores"].items()},
+        "capas_tecnologicas": prev_result["capas_tecnologicas"],
+        "resumen": prev_result["resumen"],
+        "brechas": dict(prev_result["brechas"]),
+        "preguntas_criticas": prev_result["preguntas_criticas"],
+        "mejoras_identificadas": "N/A",
+        "comparacion_anterior": "Sin cambios vs análisis anterior (resultado reutilizado)",
+        "_reused": True,
+    }
+    return _finish_result(result)
 
 
 def _find_prev_data(hu: dict, prev_index: dict) -> dict | None:
     """
     Busca el análisis previo para una HU.
-    Orden: 1) match por ID, 2) match por título exacto, 3) match por título + contenido similar.
+    Orden: 1) match por ID, 2) match por título exacto, 3) match por título + contenido similar,
+    4) match por palabras en común (HU reescrita por el PO con otras palabras u otro orden).
     """
     if not prev_index:
         return None
     by_id = prev_index.get("by_id", {})
+    by_title = prev_index.get("by_title", {})
     by_sheet = prev_index.get("by_sheet", {})
 
+    if "_norm_id" not in hu:  # HU que no viene de read_sheet_hus
+        _set_norm_keys(hu)
     sheet = hu["_sheet"]
-    norm_id = _normalize_hu_id(hu["_hu_id"])
-    title = hu.get("Titulo") or hu.get("Titulo ", "")
-    norm_title = _normalize_title(title)
-    desc = (hu.get("Descripción") or hu.get("Descripcion") or hu.get("Definición") or hu.get("Definicion") or "")
-    norm_desc = _normalize_content(desc)
+    norm_id = hu["_norm_id"]
+    norm_title = hu["_norm_title"]
+    norm_desc = hu["_norm_desc"]
 
     # 1. Match por ID
     prev = by_id.get((sheet, norm_id))
@@ -681,25 +1155,35 @@ def _find_prev_data(hu: dict, prev_index: dict) -> dict | None:
         return prev
 
     # 2. Match por título exacto
-    candidates = by_sheet.get(sheet, [])
     if norm_title:
-        for c in candidates:
-            if c["norm_title"] == norm_title:
-                return c["prev"]
+        prev = by_title.get((sheet, norm_title))
+        if prev:
+            return prev
 
     # 3. Match por título + contenido similar (score combinado)
-    if not norm_title and not norm_desc:
+    candidates = by_sheet.get(sheet)
+    if not candidates or (not norm_title and not norm_desc):
         return None
     best = None
     best_score = 0.0
-    for c in candidates:
-        title_sim = _similarity(norm_title, c["norm_title"]) if norm_title and c["norm_title"] else 0
-        desc_sim = _similarity(norm_desc, c["norm_desc"]) if norm_desc and c["norm_desc"] else 0
-        # Peso: título 60%, contenido 40%
-        score = 0.6 * title_sim + 0.4 * desc_sim
+    for c_title, c_desc, c_prev in zip(candidates["titles"], candidates["descs"], candidates["prevs"]):
+        # Peso: título 60%, contenido 40%. Solo interesa si supera al mejor actual (y el mínimo 0.70)
+        score = _combined_similarity(norm_title, c_title, norm_desc, c_desc,
+                                     threshold=max(0.70, best_score))
         if score > best_score and score >= 0.70:
             best_score = score
-            best = c["prev"]
+            best = c_prev
+    if best is not None:
+        return best
+
+    # 4. Match por palabras en común (Jaccard ≥ 0.60)
+    hu_tokens = _content_tokens(norm_title, norm_desc)
+    best_score = 0.0
+    for c_tokens, c_prev in zip(candidates.get("tokens", ()), candidates["prevs"]):
+        score = _token_similarity(hu_tokens, c_tokens)
+        if score > best_score and score >= 0.60:
+            best_score = score
+            best = c_prev
     return best
 
 
@@ -723,48 +1207,181 @@ def score_to_level(score: float) -> str:
     return "🔴 Por definir"
 
 
+def _coerce_score(v):
+    """Score 0-10 como número (la IA a veces responde "7" o "7/10"); los números pasan tal cual."""
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v
+    f = _safe_float(v)
+    return int(f) if float(f).is_integer() else f
+
+
+# (dict de pesos, tuple de (dim, peso)): app.py asigna otro DIMENSION_WEIGHTS al cambiar de versión
+_weight_pairs_cache: tuple = (None, ())
+
+
+def _weight_pairs() -> tuple:
+    """Pares (dim, peso) de DIMENSION_WEIGHTS; se rearman solo si el dict de pesos cambió."""
+    global _weight_pairs_cache
+    weights = DIMENSION_WEIGHTS
+    if _weight_pairs_cache[0] is not weights:
+        _weight_pairs_cache = (weights, tuple(weights.items()))
+    return _weight_pairs_cache[1]
+
+
 def compute_total_score(scores: dict) -> float:
     """Score total ponderado: convierte scores 0-10 a 0-100.
     Usa DIMENSION_WEIGHTS (debe tener las mismas claves que devuelve la IA en scores)."""
-    total = sum(
-        scores.get(dim, 0) * 10 * weight
-        for dim, weight in DIMENSION_WEIGHTS.items()
-    )
+    total = 0
+    for dim, weight in _weight_pairs():
+        v = scores.get(dim, 0)
+        if not isinstance(v, (int, float)):
+            v = _safe_float(v)
+        total += v * 10 * weight
     return round(total, 1)
 
 
-def analyze_hu(client: anthropic.Anthropic, hu: dict, prev_data: dict = None, retries: int = 3) -> dict:
+def _analysis_params(hu: dict, prev_data: dict = None) -> dict:
+    """Parámetros de messages.create para analizar una HU (compartidos con la Batches API)."""
+    mod = sys.modules[__name__]
+    return {
+        "model": getattr(mod, "ACTIVE_MODEL", "claude-haiku-4-5-20251001"),
+        "max_tokens": getattr(mod, "ACTIVE_MAX_TOKENS", 900),
+        "system": _system_blocks(SYSTEM_PROMPT),
+        "messages": [{"role": "user", "content": build_analysis_prompt(hu, prev_data)}],
+    }
+
+
+def _with_timeout(params: dict, n_hus: int = 1) -> dict:
+    """Agrega el timeout por llamada (ANALYSIS_TIMEOUT_SECONDS × HUs); no aplica a la Batches API."""
+    if ANALYSIS_TIMEOUT_SECONDS > 0:
+        params["timeout"] = ANALYSIS_TIMEOUT_SECONDS * n_hus
+    return params
+
+
+def _extract_json(raw: str) -> str:
+    """
+    Recorta la respuesta al objeto JSON más externo (del primer "{" al último "}").
+    Cubre bloques ```json y frases antes/después del JSON sin gastar un reintento.
+    """
+    start = raw.find("{")
+    end = raw.rfind("}")
+    return raw[start:end + 1] if start >= 0 and end > start else raw
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _decode_json(text: str):
+    """
+    JSON de una respuesta de Claude. Camino rápido: el tramo {...} completo. Si trae texto con
+    llaves después del JSON, raw_decode toma el primer objeto completo y descarta el resto;
+    como último recurso (ej. string sin cerrar) se repara con json_repair.
+    Siempre retorna un dict: lanza json.JSONDecodeError si no se recupera un objeto JSON
+    (json_repair puede devolver "", listas o strings).
+    """
+    data = _decode_json_value(text)
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError(f"Se esperaba un objeto JSON, llegó {type(data).__name__}", text, 0)
+    return data
+
+
+def _decode_json_value(text: str):
+    """Pasos de _decode_json sin validar el tipo del valor recuperado."""
+    raw = _extract_json(text)
+    try:
+        return _json_loads(raw)
+    except json.JSONDecodeError:
+        pass
+    start = text.find("{")
+    if start >= 0:
+        try:
+            return _JSON_DECODER.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            pass
+    from json_repair import loads as json_repair_loads
+    return json_repair_loads(raw)
+
+
+def _parse_analysis(msg) -> dict:
+    """
+    Convierte la respuesta de Claude en el resultado estructurado (score, nivel, etc.).
+    Lanza json.JSONDecodeError si el JSON no se puede recuperar.
+    """
+    result = _loads_response(msg)
+    _finish_result(result)
+    _set_usage(result, msg)
+    return result
+
+
+def _loads_response(msg) -> dict:
+    """Objeto JSON de la respuesta de Claude (ver _decode_json)."""
+    return _decode_json(msg.content[0].text.strip())
+
+
+def _finish_result(result: dict) -> dict:
+    """Calcula score total y nivel del análisis y completa los campos opcionales."""
+    scores = result.get("scores")
+    scores = {k: _coerce_score(v) for k, v in scores.items()} if isinstance(scores, dict) else {}
+    result["scores"] = scores
+    result["score_total"] = compute_total_score(scores)
+    result["nivel"] = score_to_level(result["score_total"])
+    result.setdefault("mejoras_identificadas", "N/A")
+    result.setdefault("comparacion_anterior", "N/A")
+    return result
+
+
+def _set_usage(result: dict, msg) -> None:
+    """Tokens leídos / escritos en el prompt cache (para verificar hits en el progreso y el resumen)."""
+    usage = getattr(msg, "usage", None)
+    result["_cache_read_tokens"] = getattr(usage, "cache_read_input_tokens", 0) or 0
+    result["_cache_creation_tokens"] = getattr(usage, "cache_creation_input_tokens", 0) or 0
+
+
+class _TokenBucket:
+    """
+    Cubeta de tokens de entrada por minuto compartida entre los workers de run().
+    acquire(n) espera hasta que haya cupo; se rellena de forma continua (per_minute / 60 por segundo).
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int) -> float:
+        """Descuenta n tokens (esperando si hace falta) y retorna los segundos esperados."""
+        n = min(float(n), self.capacity)  # una llamada más grande que el cupo pasa con la cubeta llena
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def _estimate_input_tokens(items: list[tuple[dict, dict]]) -> int:
+    """Tokens de entrada aproximados de una llamada (~4 caracteres por token; sin llamar a count_tokens)."""
+    chars = len(SYSTEM_PROMPT) + len(ANALYSIS_INSTRUCTIONS if len(items) == 1 else BATCH_ANALYSIS_INSTRUCTIONS)
+    chars += sum(len(_hu_prompt_text(hu, prev)) for hu, prev in items)
+    return chars // 4
+
+
+def analyze_hu(client: "anthropic.Anthropic", hu: dict, prev_data: dict = None, retries: int = 3) -> dict:
     """Envía una HU a Claude y retorna el análisis estructurado."""
+    import anthropic
+
     for attempt in range(retries):
         try:
-            msg = client.messages.create(
-                model=getattr(sys.modules[__name__], "ACTIVE_MODEL", "claude-haiku-4-5-20251001"),
-                max_tokens=getattr(sys.modules[__name__], "ACTIVE_MAX_TOKENS", 900),
-                system=SYSTEM_PROMPT,
-                messages=[{"role": "user", "content": build_analysis_prompt(hu, prev_data)}]
-            )
-            raw = msg.content[0].text.strip()
-
-            # Limpiar bloques markdown si los hay
-            if raw.startswith("```"):
-                lines = raw.split("\n")
-                raw = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
-
-            # Parsear JSON; si falla (ej. string sin cerrar), intentar reparar con json_repair
-            try:
-                result = json.loads(raw)
-            except json.JSONDecodeError:
-                try:
-                    from json_repair import loads as json_repair_loads
-                    result = json_repair_loads(raw)
-                except Exception:
-                    raise
-            scores = result.get("scores", {})
-            result["score_total"] = compute_total_score(scores)
-            result["nivel"] = score_to_level(result["score_total"])
-            result.setdefault("mejoras_identificadas", "N/A")
-            result.setdefault("comparacion_anterior", "N/A")
-            return result
+            msg = client.messages.create(**_with_timeout(_analysis_params(hu, prev_data)))
+            return _parse_analysis(msg)
 
         except json.JSONDecodeError as e:
             if attempt < retries - 1:
@@ -776,6 +1393,11 @@ def analyze_hu(client: anthropic.Anthropic, hu: dict, prev_data: dict = None, re
             wait = 30 * (attempt + 1)
             print(f"    ⏳  Rate limit, esperando {wait}s...")
             time.sleep(wait)
+        except anthropic.APITimeoutError:
+            if attempt < retries - 1:
+                print(f"    ⏱  Timeout, reintento {attempt + 2}/{retries}...")
+            else:
+                return _error_result("Timeout de la llamada a Claude")
         except Exception as e:
             err_msg = str(e)
             if _is_credits_or_tokens_error(err_msg):
@@ -788,6 +1410,91 @@ def analyze_hu(client: anthropic.Anthropic, hu: dict, prev_data: dict = None, re
     return _error_result("Máximo de reintentos alcanzado")
 
 
+def analyze_hu_group(client: "anthropic.Anthropic", items: list[tuple[dict, dict]]) -> list[dict]:
+    """
+    Analiza varias HUs en una sola llamada (items: lista de (hu, prev_data)).
+    El system prompt y las instrucciones se envían una vez por grupo en lugar de una vez por HU.
+    Si la respuesta no trae un análisis válido por HU, ese grupo se analiza HU por HU con analyze_hu.
+    """
+    if len(items) == 1:
+        return [analyze_hu(client, items[0][0], prev_data=items[0][1])]
+    import anthropic
+
+    params = _analysis_params(items[0][0], items[0][1])
+    params["max_tokens"] *= len(items)
+    params["messages"] = [{"role": "user", "content": build_batch_analysis_prompt(
+        [hu for hu, _ in items], [prev for _, prev in items])}]
+    try:
+        msg = client.messages.create(**_with_timeout(params, len(items)))
+        data = _loads_response(msg)
+        results = data.get("results") if isinstance(data, dict) else None
+        if (isinstance(results, list) and len(results) == len(items)
+                and all(isinstance(r, dict) and isinstance(r.get("scores"), dict) for r in results)):
+            for r in results:
+                _finish_result(r)
+                r["_cache_read_tokens"] = r["_cache_creation_tokens"] = 0
+            _set_usage(results[0], msg)  # el uso es de la llamada: se cuenta una sola vez
+            return results
+    except anthropic.RateLimitError:
+        pass  # analyze_hu espera y reintenta por su cuenta
+    except Exception as e:
+        if _is_credits_or_tokens_error(str(e)):
+            raise AnthropicGameOverError(str(e))
+    # Respuesta incompleta o inválida: HU por HU (con sus reintentos)
+    return [analyze_hu(client, hu, prev_data=prev) for hu, prev in items]
+
+
+def analyze_hus_batch(client: "anthropic.Anthropic", items: list[tuple], progress_fn=None,
+                      poll_seconds: float = None) -> dict[int, dict]:
+    """
+    Analiza varias HUs con la Message Batches API (se procesan en paralelo del lado de
+    Anthropic, a 50% del costo). items: lista de (idx, hu, prev_data).
+    progress_fn(terminadas) se llama en cada sondeo del estado del batch.
+    Retorna {idx: resultado} solo de las HUs con un análisis válido; las que fallaron, expiraron
+    o trajeron JSON inválido no vienen en el dict y el llamador las analiza en modo normal.
+    """
+    poll_seconds = BATCH_POLL_SECONDS if poll_seconds is None else poll_seconds
+    # custom_id debe ser único y simple (^[a-zA-Z0-9_-]{1,64}$): se usa el índice, no el ID de la HU
+    by_custom_id = {f"hu-{idx}": (idx, hu, prev) for idx, hu, prev in items}
+    try:
+        batch = client.messages.batches.create(requests=[
+            {"custom_id": cid, "params": _analysis_params(hu, prev)}
+            for cid, (_, hu, prev) in by_custom_id.items()
+        ])
+        while batch.processing_status != "ended":
+            if progress_fn:
+                rc = batch.request_counts
+                progress_fn(rc.succeeded + rc.errored + rc.canceled + rc.expired)
+            time.sleep(poll_seconds)
+            batch = client.messages.batches.retrieve(batch.id)
+        entries = list(client.messages.batches.results(batch.id))
+    except Exception as e:
+        if _is_credits_or_tokens_error(str(e)):
+            raise AnthropicGameOverError(str(e))
+        raise
+
+    results: dict[int, dict] = {}
+    for entry in entries:
+        if entry.custom_id not in by_custom_id:
+            continue
+        if entry.result.type != "succeeded":
+            continue
+        idx = by_custom_id[entry.custom_id][0]
+        # Una entrada mala (sin contenido, JSON inválido, sin scores) no tumba al resto del batch
+        try:
+            msg = entry.result.message
+            data = _loads_response(msg)
+            if isinstance(data.get("scores"), dict):
+                _finish_result(data)
+                _set_usage(data, msg)
+                results[idx] = data
+        except Exception:
+            pass
+    if progress_fn:
+        progress_fn(len(results))
+    return results
+
+
 def _is_credits_or_tokens_error(msg: str) -> bool:
     """Detecta si el error es por créditos o tokens agotados."""
     m = (msg or "").lower()
@@ -813,6 +1520,23 @@ def _error_result(msg: str) -> dict:
     }
 
 
+def _brechas_preview(brechas: dict, limit: int = 200) -> str:
+    """Brechas pendientes "dim: texto | ..." recortadas a `limit`; deja de armar en cuanto se llena."""
+    parts, size = [], -3
+    for k, v in brechas.items():
+        if not v:
+            continue
+        sv = v if isinstance(v, str) else str(v)
+        if "Completo" in sv:
+            continue
+        part = f"{k}: {sv[:50] + '...' if len(sv) > 50 else sv}"
+        parts.append(part)
+        size += len(part) + 3  # + " | "
+        if size >= limit:
+            break
+    return " | ".join(parts)[:limit]
+
+
 def _build_initiative_summary_for_executive(sheet_name: str, results: list[dict]) -> str:
     """Construye un resumen compacto de una iniciativa para el prompt de análisis ejecutivo."""
     lines = [f"INICIATIVA: {sheet_name}", f"HUs: {len(results)}, Score promedio: {sum(r['score_total'] for r in results) / len(results):.1f}"]
@@ -824,12 +1548,12 @@ def _build_initiative_summary_for_executive(sheet_name: str, results: list[dict]
         mejoras = (r.get("mejoras_identificadas") or "N/A")[:120]
         comparacion = (r.get("comparacion_anterior") or "N/A")[:120]
         brechas = r.get("brechas") or {}
-        brechas_txt = " | ".join(f"{k}: {(str(v)[:50]+'...' if len(str(v))>50 else v)}" for k, v in brechas.items() if v and "Completo" not in str(v))[:200]
+        brechas_txt = _brechas_preview(brechas)
         lines.append(f"  {hu_id} ({score:.0f}, {nivel}): Resumen: {resumen}. Mejoras: {mejoras}. Comparación: {comparacion}. Brechas: {brechas_txt}")
     return "\n".join(lines)
 
 
-def generate_executive_analysis(client: anthropic.Anthropic, by_sheet: dict[str, list[dict]], silent: bool = False, mvp_filtered: bool = False) -> dict[str, str]:
+def generate_executive_analysis(client: "anthropic.Anthropic", by_sheet: dict[str, list[dict]], silent: bool = False, mvp_filtered: bool = False) -> dict[str, str]:
     """
     Genera un párrafo de análisis ejecutivo por iniciativa.
     Retorna dict[nombre_iniciativa] -> párrafo.
@@ -859,18 +1583,15 @@ def generate_executive_analysis(client: anthropic.Anthropic, by_sheet: dict[str,
         msg = client.messages.create(
             model="claude-sonnet-4-20250514",
             max_tokens=4000,
-            system=EXECUTIVE_ANALYSIS_PROMPT,
+            system=_system_blocks(EXECUTIVE_ANALYSIS_PROMPT),
             messages=[{"role": "user", "content": prompt}],
         )
-        raw = msg.content[0].text.strip()
-        if raw.startswith("```"):
-            lines = raw.split("\n")
-            raw = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
-        try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
-            from json_repair import loads as json_repair_loads
-            data = json_repair_loads(raw)
+        usage = getattr(msg, "usage", None)
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        cache_created = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        if cache_read or cache_created:
+            _log(f"  ⚡  Prompt cache (ejecutivo): {cache_read:,} tokens leídos, {cache_created:,} escritos")
+        data = _decode_json(msg.content[0].text.strip())
         out = {}
         for item in data.get("iniciativas", []):
             nombre = item.get("nombre", "").strip()
@@ -910,64 +1631,92 @@ def _sanitize_for_excel(value):
     return "".join(result)
 
 
-def _thin_border():
-    s = Side(style="thin", color="D0D0D0")
-    return Border(left=s, right=s, top=s, bottom=s)
+# Estilos compartidos: openpyxl copia el estilo al asignarlo, así que basta con un
+# objeto por combinación en lugar de construir Font/PatternFill/... por celda.
+_THIN_SIDE = Side(style="thin", color="D0D0D0")
+_THIN_BORDER = Border(left=_THIN_SIDE, right=_THIN_SIDE, top=_THIN_SIDE, bottom=_THIN_SIDE)
+_THICK_SIDE = Side(style="medium", color="1F3864")
+_THICK_BORDER = Border(left=_THICK_SIDE, right=_THICK_SIDE, top=_THICK_SIDE, bottom=_THICK_SIDE)
+_FILL_BY_HEX: dict[str, PatternFill] = {}
+
 
-def _thick_border():
-    s = Side(style="medium", color="1F3864")
-    return Border(left=s, right=s, top=s, bottom=s)
+def _fill(hex_color: str) -> PatternFill:
+    """PatternFill sólido interno por color (uno por hex en todo el proceso)."""
+    fill = _FILL_BY_HEX.get(hex_color)
+    if fill is None:
+        fill = _FILL_BY_HEX[hex_color] = PatternFill("solid", start_color=hex_color, end_color=hex_color)
+    return fill
+
+
+@lru_cache(maxsize=128)
+def _font(size: int, color: str | None = None, bold: bool = False, italic: bool = False) -> Font:
+    return Font(bold=bold, italic=italic, name="Arial", size=size, color=color)
+
+
+@lru_cache(maxsize=32)
+def _align(horizontal: str | None = None, vertical: str = "center", wrap: bool = False) -> Alignment:
+    return Alignment(horizontal=horizontal, vertical=vertical, wrap_text=wrap)
+
+
+_BLUE_FILL = _fill("1F3864")
+
+_ROW_FILLS = (_fill("FFFFFF"), _fill("F5F8FF"))  # filas pares / impares de análisis
+_BASE_FONT, _BASE_ALIGN = _font(9), _align(None, "top", True)  # celdas de análisis sin color propio
+_col = lru_cache(maxsize=512)(get_column_letter)  # índice de columna → letra, memoizado
 
 def _h1(cell, text, bg="1F3864"):
     cell.value = _sanitize_for_excel(text) if isinstance(text, str) else text
-    cell.font = Font(bold=True, color="FFFFFF", name="Arial", size=12)
-    cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
-    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    cell.border = _thick_border()
+    cell.font = _font(12, "FFFFFF", bold=True)
+    cell.fill = _fill(bg)
+    cell.alignment = _align("center", "center", True)
+    cell.border = _THICK_BORDER
 
 def _h2(cell, text, bg="2E75B6"):
     cell.value = _sanitize_for_excel(text) if isinstance(text, str) else text
-    cell.font = Font(bold=True, color="FFFFFF", name="Arial", size=10)
-    cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
-    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    cell.border = _thin_border()
+    cell.font = _font(10, "FFFFFF", bold=True)
+    cell.fill = _fill(bg)
+    cell.alignment = _align("center", "center", True)
+    cell.border = _THIN_BORDER
 
 def _data(cell, value, bold=False, bg=None, fc="000000", align="left", size=9):
     cell.value = _sanitize_for_excel(value) if isinstance(value, str) else value
-    cell.font = Font(bold=bold, name="Arial", size=size, color=fc)
-    cell.alignment = Alignment(horizontal=align, vertical="center", wrap_text=True)
-    cell.border = _thin_border()
+    cell.font = _font(size, fc, bold=bold)
+    cell.alignment = _align(align, "center", True)
+    cell.border = _THIN_BORDER
     if bg:
-        cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
+        cell.fill = _fill(bg)
+
+# Cortes de color (0-100) y sus colores (bg, fc) de menor a mayor: un bisect por celda
+_SCORE_THRESHOLDS = (30, 55, 75, 90)
+_SCORE_COLORS = (
+    ("FFC7CE", "9C0006"),
+    ("FCEBD5", "843C0C"),
+    ("FFEB9C", "9C6500"),
+    ("C6EFCE", "375623"),
+    ("E2EFDA", "375623"),
+)
+_SCORE_TOTAL_COLORS = tuple((fc, bg) for bg, fc in _SCORE_COLORS)
+
+_NIVEL_COLORS = {
+    "🟢 Excelente": ("E2EFDA", "375623"),
+    "🔵 Completo":  ("DDEEFF", "1F3864"),
+    "🟡 Aceptable": ("FFEB9C", "9C6500"),
+    "🟠 En progreso": ("FCEBD5", "843C0C"),
+    "🔴 Por definir": ("FFC7CE", "9C0006"),
+    "⛔ Error":     ("F2F2F2", "595959"),
+}
 
 def _score_dim_color(score_0_10: float) -> tuple[str, str]:
     """(bg, fc) para scores de dimensión 0-10."""
-    s = score_0_10 * 10
-    if s >= 90: return "E2EFDA", "375623"
-    if s >= 75: return "C6EFCE", "375623"
-    if s >= 55: return "FFEB9C", "9C6500"
-    if s >= 30: return "FCEBD5", "843C0C"
-    return "FFC7CE", "9C0006"
+    return _SCORE_COLORS[bisect.bisect_right(_SCORE_THRESHOLDS, score_0_10 * 10)]
 
 def _score_total_color(score: float) -> tuple[str, str]:
     """(fc, bg) para score total 0-100."""
-    if score >= 90: return "375623", "E2EFDA"
-    if score >= 75: return "375623", "C6EFCE"
-    if score >= 55: return "9C6500", "FFEB9C"
-    if score >= 30: return "843C0C", "FCEBD5"
-    return "9C0006", "FFC7CE"
+    return _SCORE_TOTAL_COLORS[bisect.bisect_right(_SCORE_THRESHOLDS, score)]
 
 def _nivel_color(nivel: str) -> tuple[str, str]:
     """(bg, fc) para el nivel de completitud."""
-    m = {
-        "🟢 Excelente": ("E2EFDA", "375623"),
-        "🔵 Completo":  ("DDEEFF", "1F3864"),
-        "🟡 Aceptable": ("FFEB9C", "9C6500"),
-        "🟠 En progreso": ("FCEBD5", "843C0C"),
-        "🔴 Por definir": ("FFC7CE", "9C0006"),
-        "⛔ Error":     ("F2F2F2", "595959"),
-    }
-    return m.get(nivel, ("F2F2F2", "595959"))
+    return _NIVEL_COLORS.get(nivel, ("F2F2F2", "595959"))
 
 def _fmt_brechas(text: str) -> str:
     if not text or text.strip() in ("Completo", "", "nan"):
@@ -1001,114 +1750,155 @@ def _fmt_comparacion(text: str) -> str:
 # 7. ESCRITURA DE ANÁLISIS EN HOJAS DE HUs
 # ══════════════════════════════════════════════════════════════════════════════
 
-def write_analysis_to_sheet(ws, results_by_row: dict):
-    """Agrega columnas de análisis a la derecha de los datos existentes."""
+def _prepare_analysis_columns(ws) -> int:
+    """Agrega la columna separadora y los headers de análisis; retorna la columna de SCORE TOTAL."""
     header_row = _detect_header_row(ws)
     last_col = ws.max_column
     sep_col  = last_col + 1
     start_col = sep_col + 1
 
     # Columna separadora visual azul
-    ws.column_dimensions[get_column_letter(sep_col)].width = 2
-    for row in range(1, ws.max_row + 1):
-        ws.cell(row=row, column=sep_col).fill = PatternFill(
-            "solid", start_color="1F3864", end_color="1F3864"
-        )
+    ws.column_dimensions[_col(sep_col)].width = 2
+    for (cell,) in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=sep_col, max_col=sep_col):
+        cell.fill = _BLUE_FILL
 
     # Headers de análisis (usa la fila detectada para esta hoja)
     ws.row_dimensions[header_row].height = 50
     for i, (hdr_text, color, width) in enumerate(ANALYSIS_HEADERS):
         col = start_col + i
-        _h2(ws.cell(row=header_row, column=col), hdr_text, bg=color)
-        ws.column_dimensions[get_column_letter(col)].width = width
+        cell = ws.cell(row=header_row, column=col, value=hdr_text)
+        cell.font = _ANALYSIS_HEADER_FONT
+        cell.fill = _ANALYSIS_HEADER_FILLS[color]
+        cell.alignment = _ANALYSIS_HEADER_ALIGN
+        cell.border = _ANALYSIS_HEADER_BORDER
+        ws.column_dimensions[_col(col)].width = width
+    return start_col
+
+
+# Estilos fijos (font, fill) de las columnas de texto del análisis, por offset desde start_col;
+# las columnas sin entrada usan _BASE_FONT con el fill alternado de la fila.
+_ANALYSIS_TEXT_STYLES = {
+    8:  (_font(9, "1F3864"), _fill("E8F4FD")),              # Capas tecnológicas involucradas
+    16: (_font(9, "7B2C2C", bold=True), _fill("FFF0F0")),   # Preguntas para prerefinamiento
+    17: (_font(9, "375623"), _fill("E2EFDA")),              # Mejoras identificadas
+    18: (_font(9, "7B2C2C"), _fill("FFF5F5")),              # Comparación vs anterior
+}
+_BRECHA_OK_STYLE = (_font(9, "375623"), _fill("E2EFDA"))
+_BRECHA_FILL = _fill("FFF5F5")
+_CENTER_ALIGN = _align("center")
+_SCORE_DIM_KEYS = ("funcional", "capas_tec", "ux_ui", "integraciones", "regulatorio", "criterios")
+
+
+def _write_analysis_row(ws, row_idx: int, result: dict, start_col: int) -> None:
+    """Escribe las columnas de análisis de una HU en su fila, a partir de start_col."""
+    ws.row_dimensions[row_idx].height = 100
+    row_fill = _ROW_FILLS[row_idx & 1]
+
+    scores    = result.get("scores", {})
+    score_tot = result.get("score_total", 0)
+    nivel     = result.get("nivel", "⛔ Error")
+    brechas   = result.get("brechas", {})
+
+    # (valor, font, fill, align) por columna: cada celda se escribe una sola vez
+    fc, bg = _score_total_color(score_tot)
+    cells = [(score_tot, _font(14, fc, bold=True), _fill(bg), _CENTER_ALIGN)]
+    bg, fc = _nivel_color(nivel)
+    cells.append((nivel, _font(9, fc, bold=True), _fill(bg), _CENTER_ALIGN))
+    for dim in _SCORE_DIM_KEYS:
+        value = scores.get(dim, 0)
+        bg, fc = _score_dim_color(float(value))
+        cells.append((f"{value}/10", _font(10, fc, bold=True), _fill(bg), _CENTER_ALIGN))
+
+    text_values = [
+        _fmt_capas(result.get("capas_tecnologicas", "")),
+        result.get("resumen", ""),
+        *(_fmt_brechas(brechas.get(dim, "")) for dim in _SCORE_DIM_KEYS),
+        _fmt_preguntas(result.get("preguntas_criticas", "")),
+        _fmt_mejoras(result.get("mejoras_identificadas", "N/A")),
+        _fmt_comparacion(result.get("comparacion_anterior", "N/A")),
+    ]
+    for i, value in enumerate(text_values, 8):
+        font, fill = _ANALYSIS_TEXT_STYLES.get(i, (_BASE_FONT, row_fill))
+        if 10 <= i <= 15:  # Brechas
+            font, fill = _BRECHA_OK_STYLE if str(value).startswith("✅") else (_BASE_FONT, _BRECHA_FILL)
+        cells.append((value, font, fill, _BASE_ALIGN))
 
-    # Datos por fila
-    row_fills = ["FFFFFF", "F5F8FF"]
+    for col, (value, font, fill, align) in enumerate(cells, start_col):
+        cell = ws.cell(row=row_idx, column=col,
+                       value=_sanitize_for_excel(value) if isinstance(value, str) else value)
+        cell.border = _THIN_BORDER
+        cell.font = font
+        cell.fill = fill
+        cell.alignment = align
+
+
+def write_analysis_to_sheet(ws, results_by_row: dict):
+    """Agrega columnas de análisis a la derecha de los datos existentes."""
+    start_col = _prepare_analysis_columns(ws)
     for row_idx, result in results_by_row.items():
-        ws.row_dimensions[row_idx].height = 100
-        bg_row = row_fills[row_idx % 2]
-
-        scores    = result.get("scores", {})
-        score_tot = result.get("score_total", 0)
-        nivel     = result.get("nivel", "⛔ Error")
-        brechas   = result.get("brechas", {})
-
-        col_values = [
-            score_tot,
-            nivel,
-            scores.get("funcional", 0),
-            scores.get("capas_tec", 0),
-            scores.get("ux_ui", 0),
-            scores.get("integraciones", 0),
-            scores.get("regulatorio", 0),
-            scores.get("criterios", 0),
-            _fmt_capas(result.get("capas_tecnologicas", "")),
-            result.get("resumen", ""),
-            _fmt_brechas(brechas.get("funcional", "")),
-            _fmt_brechas(brechas.get("capas_tec", "")),
-            _fmt_brechas(brechas.get("ux_ui", "")),
-            _fmt_brechas(brechas.get("integraciones", "")),
-            _fmt_brechas(brechas.get("regulatorio", "")),
-            _fmt_brechas(brechas.get("criterios", "")),
-            _fmt_preguntas(result.get("preguntas_criticas", "")),
-            _fmt_mejoras(result.get("mejoras_identificadas", "N/A")),
-            _fmt_comparacion(result.get("comparacion_anterior", "N/A")),
-        ]
+        _write_analysis_row(ws, row_idx, result, start_col)
 
-        for i, value in enumerate(col_values):
-            col = start_col + i
-            safe_val = _sanitize_for_excel(value) if isinstance(value, str) else value
-            cell = ws.cell(row=row_idx, column=col, value=safe_val)
-            cell.font = Font(name="Arial", size=9)
-            cell.alignment = Alignment(vertical="top", wrap_text=True)
-            cell.border = _thin_border()
-            cell.fill = PatternFill("solid", start_color=bg_row, end_color=bg_row)
-
-            if i == 0:  # Score total
-                fc, bg = _score_total_color(score_tot)
-                cell.font = Font(bold=True, name="Arial", size=14, color=fc)
-                cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-
-            elif i == 1:  # Nivel
-                bg, fc = _nivel_color(nivel)
-                cell.font = Font(bold=True, name="Arial", size=9, color=fc)
-                cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-
-            elif 2 <= i <= 7:  # Scores por dimensión
-                bg, fc = _score_dim_color(float(value))
-                cell.font = Font(bold=True, name="Arial", size=10, color=fc)
-                cell.fill = PatternFill("solid", start_color=bg, end_color=bg)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                cell.value = _sanitize_for_excel(f"{value}/10")
-
-            elif i == 8:  # Capas tecnológicas involucradas
-                cell.font = Font(name="Arial", size=9, color="1F3864")
-                cell.fill = PatternFill("solid", start_color="E8F4FD", end_color="E8F4FD")
-
-            elif 10 <= i <= 15:  # Brechas
-                if str(value).startswith("✅"):
-                    cell.font = Font(name="Arial", size=9, color="375623")
-                    cell.fill = PatternFill("solid", start_color="E2EFDA", end_color="E2EFDA")
-                else:
-                    cell.fill = PatternFill("solid", start_color="FFF5F5", end_color="FFF5F5")
 
-            elif i == 16:  # Preguntas para prerefinamiento
-                cell.font = Font(bold=True, name="Arial", size=9, color="7B2C2C")
-                cell.fill = PatternFill("solid", start_color="FFF0F0", end_color="FFF0F0")
-            elif i == 17:  # Mejoras identificadas
-                cell.font = Font(name="Arial", size=9, color="375623")
-                cell.fill = PatternFill("solid", start_color="E2EFDA", end_color="E2EFDA")
-            elif i == 18:  # Comparación vs anterior
-                cell.font = Font(name="Arial", size=9, color="7B2C2C")
-                cell.fill = PatternFill("solid", start_color="FFF5F5", end_color="FFF5F5")
+def _start_workbook_writer(input_path: str) -> tuple[queue.Queue, threading.Thread, dict]:
+    """
+    Hilo escritor: abre el workbook de salida y escribe cada resultado apenas termina su HU,
+    así cargar el Excel y escribir las filas se solapa con la espera a Claude.
+    Consume resultados de la cola hasta recibir None; al terminar state["wb"] tiene el workbook
+    (o state["error"] la excepción, y el llamador escribe todo al final como respaldo).
+    Solo este hilo toca el workbook mientras corre (openpyxl no es thread-safe).
+    """
+    write_queue: queue.Queue = queue.Queue()
+    state = {"wb": None, "error": None}
+
+    def _writer():
+        try:
+            wb = openpyxl.load_workbook(input_path)
+            start_cols: dict[str, int] = {}
+            while (result := write_queue.get()) is not None:
+                sheet_name = result["_sheet"]
+                if sheet_name not in wb.sheetnames:
+                    continue
+                ws = wb[sheet_name]
+                if sheet_name not in start_cols:
+                    start_cols[sheet_name] = _prepare_analysis_columns(ws)
+                _write_analysis_row(ws, result["_row"], result, start_cols[sheet_name])
+            state["wb"] = wb
+        except Exception as e:
+            state["error"] = e
+
+    thread = threading.Thread(target=_writer, name="hu-writer", daemon=True)
+    thread.start()
+    return write_queue, thread, state
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 8. HOJA DE SÍNTESIS EJECUTIVA
 # ══════════════════════════════════════════════════════════════════════════════
 
+def _score_means(results: list[dict], dims: tuple[str, ...] = None) -> tuple[float, dict[str, float]]:
+    """
+    Promedio de score_total y de cada dimensión en una sola pasada:
+    arma la matriz HU × dimensión una vez y suma por columnas.
+    dims: claves de dimensión ya calculadas por el llamador (default: las de DIMENSIONS).
+    """
+    dims = tuple(DIMENSIONS) if dims is None else dims
+    n = len(results)
+    if not n:
+        return 0.0, dict.fromkeys(dims, 0)
+    matrix = [[s.get(d, 0) for d in dims] for s in (r.get("scores", {}) for r in results)]
+    avg_total = sum(r["score_total"] for r in results) / n
+    return avg_total, {d: col_sum / n for d, col_sum in zip(dims, map(sum, zip(*matrix)))}
+
+
+@lru_cache(maxsize=4096)
+def _split_brecha(raw: str) -> tuple[str, ...]:
+    """Items de una celda de brechas ("a | b | c") agrupables: >12 chars, clave de 70 chars."""
+    if raw in ("Completo", "", "nan"):
+        return ()
+    items = (item.strip() for item in raw.split("|"))
+    return tuple(item[:70] for item in items if len(item) > 12)
+
+
 def create_synthesis_sheet(wb, all_results: list[dict]):
     """Crea la hoja '📊 Síntesis Ejecutiva' con KPIs, tabla de scores y brechas."""
 
@@ -1132,6 +1922,10 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
         ws["A1"].value = "Sin datos válidos para mostrar."
         return
 
+    # Dimensiones activas, leídas una vez por llamada (app.py puede reemplazar DIMENSIONS)
+    dim_items = tuple(DIMENSIONS.items())
+    all_dim_keys = tuple(d for d, _ in dim_items)
+
     # Solo HUs de Fase 1/MVP para overall (si existe columna MVP/Fase)
     has_mvp_filter = any(not r.get("_is_mvp", True) for r in valid)
     mvp_valid = [r for r in valid if r.get("_is_mvp", True)] if has_mvp_filter else valid
@@ -1143,6 +1937,13 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
     for r in mvp_valid:
         by_sheet.setdefault(r.get("_sheet", "Sin hoja"), []).append(r)
 
+    # Promedios por iniciativa: se calculan una vez y los usan las secciones B y C
+    sheet_stats: dict[str, dict] = {}
+    for sheet_name, sheet_results in by_sheet.items():
+        avg_total, avg_dims = _score_means(sheet_results, all_dim_keys)
+        sheet_stats[sheet_name] = {"n": len(sheet_results), "avg_total": avg_total,
+                                   "avg_dims": avg_dims, "results": sheet_results}
+
     cur = 1  # cursor de fila actual
 
     # ── TÍTULO ────────────────────────────────────────────────────────────
@@ -1161,8 +1962,8 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
         f"HUs MVP (overall): {len(mvp_valid)}{mvp_note}  |  "
         f"Iniciativas: {', '.join(by_sheet.keys())}"
     )
-    ws[f"A{cur}"].font = Font(italic=True, name="Arial", size=9, color="595959")
-    ws[f"A{cur}"].alignment = Alignment(horizontal="center", vertical="center")
+    ws[f"A{cur}"].font = _font(9, "595959", italic=True)
+    ws[f"A{cur}"].alignment = _align("center")
     cur += 2
 
     # ══════════════════════════════════════════════════════════════════════
@@ -1174,10 +1975,7 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
     cur += 1
 
     all_scores = [r["score_total"] for r in mvp_valid]
-    nivel_counts: dict[str, int] = {}
-    for r in mvp_valid:
-        n = r.get("nivel", "")
-        nivel_counts[n] = nivel_counts.get(n, 0) + 1
+    nivel_counts = Counter(r.get("nivel", "") for r in mvp_valid)
 
     avg_global = sum(all_scores) / len(all_scores) if all_scores else 0
 
@@ -1214,15 +2012,15 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
     # Sub-encabezados de tabla (dinámicos según DIMENSIONS activas)
     ws.row_dimensions[cur].height = 50
     dim_col_letters = ["D", "E", "F", "G", "H", "I"]
-    dim_keys = list(DIMENSIONS.keys())[:6]
+    dim_keys = all_dim_keys[:6]
     sub_hdrs = [
         ("A", "#", "44546A"),
         ("B", "INICIATIVA\n(Producto)", "44546A"),
         ("C", "SCORE TOTAL\n(0-100)", "1F3864"),
     ]
-    for dk, col in zip(dim_keys, dim_col_letters):
+    for (dk, label), col in zip(dim_items, dim_col_letters):
         w = int(DIMENSION_WEIGHTS.get(dk, 0) * 100)
-        short = (DIMENSIONS[dk].split(" ")[0] if DIMENSIONS[dk] else dk)[:10]
+        short = (label.split(" ")[0] if label else dk)[:10]
         sub_hdrs.append((col, f"{short}\n(0-10)\n{w}%", "2E75B6"))
     sub_hdrs.extend([
         ("J", "", "FFFFFF"),
@@ -1237,91 +2035,85 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
     row_fills = ["FFFFFF", "F5F8FF"]
     table_data_start = cur
 
-    dim_cols = list(zip(dim_keys, dim_col_letters[: len(dim_keys)]))
+    # Filas de datos: coordenadas numéricas (ws.cell) en lugar de parsear "A12" por celda
+    dim_cols = list(zip(dim_keys, range(4, 4 + len(dim_keys))))  # D..I
 
-    for sheet_idx, (sheet_name, sheet_results) in enumerate(by_sheet.items(), 1):
+    for sheet_idx, (sheet_name, stats) in enumerate(sheet_stats.items(), 1):
         ws.row_dimensions[cur].height = 22
         fill = row_fills[cur % 2]
 
-        avg_total = sum(r["score_total"] for r in sheet_results) / len(sheet_results)
-        avg_dims  = {
-            d: sum(r.get("scores", {}).get(d, 0) for r in sheet_results) / len(sheet_results)
-            for d in DIMENSIONS
-        }
+        sheet_results = stats["results"]
+        avg_total, avg_dims = stats["avg_total"], stats["avg_dims"]
         nivel = score_to_level(avg_total)
 
         # Contar HUs por definir y en progreso
-        por_definir = sum(1 for r in sheet_results if r["score_total"] < 30)
-        en_progreso = sum(1 for r in sheet_results if 30 <= r["score_total"] < 55)
+        ids_pd, ids_ep = [], []
+        for r in sheet_results:
+            if r["score_total"] < 30:
+                ids_pd.append(r["_hu_id"])
+            elif r["score_total"] < 55:
+                ids_ep.append(r["_hu_id"])
         criticas_txt = ""
-        if por_definir:
-            ids_pd = [r["_hu_id"] for r in sheet_results if r["score_total"] < 30]
+        if ids_pd:
             criticas_txt += f"🔴 Por definir: {', '.join(ids_pd)}\n"
-        if en_progreso:
-            ids_ep = [r["_hu_id"] for r in sheet_results if 30 <= r["score_total"] < 55]
+        if ids_ep:
             criticas_txt += f"🟠 En progreso: {', '.join(ids_ep)}"
         if not criticas_txt:
             criticas_txt = "✅ Ninguna"
 
-        _data(ws[f"A{cur}"], sheet_idx, align="center", bg=fill)
-        hu_label = f"{sheet_name}  ({len(sheet_results)} HUs MVP)" if has_mvp_filter else f"{sheet_name}  ({len(sheet_results)} HUs)"
-        _data(ws[f"B{cur}"], hu_label, bold=True, bg=fill)
+        _data(ws.cell(row=cur, column=1), sheet_idx, align="center", bg=fill)
+        hu_label = f"{sheet_name}  ({stats['n']} HUs MVP)" if has_mvp_filter else f"{sheet_name}  ({stats['n']} HUs)"
+        _data(ws.cell(row=cur, column=2), hu_label, bold=True, bg=fill)
 
         fc_t, bg_t = _score_total_color(avg_total)
-        _data(ws[f"C{cur}"], round(avg_total, 1), bold=True, align="center",
+        _data(ws.cell(row=cur, column=3), round(avg_total, 1), bold=True, align="center",
               fc=fc_t, bg=bg_t, size=12)
 
         for dim, col in dim_cols:
             val = round(avg_dims[dim], 1)
             bg_d, fc_d = _score_dim_color(val)
-            _data(ws[f"{col}{cur}"], f"{val}/10", bold=True, align="center",
+            _data(ws.cell(row=cur, column=col), f"{val}/10", bold=True, align="center",
                   fc=fc_d, bg=bg_d)
 
-        ws[f"J{cur}"].fill = PatternFill("solid", start_color="1F3864", end_color="1F3864")
+        ws.cell(row=cur, column=10).fill = _BLUE_FILL
 
         bg_n, fc_n = _nivel_color(nivel)
-        _data(ws[f"K{cur}"], nivel, bold=True, align="center", fc=fc_n, bg=bg_n)
+        _data(ws.cell(row=cur, column=11), nivel, bold=True, align="center", fc=fc_n, bg=bg_n)
 
-        ws[f"L{cur}"].fill = PatternFill("solid", start_color="1F3864", end_color="1F3864")
+        ws.cell(row=cur, column=12).fill = _BLUE_FILL
 
-        cell_crit = ws[f"M{cur}"]
+        cell_crit = ws.cell(row=cur, column=13)
         cell_crit.value = _sanitize_for_excel(criticas_txt)
-        cell_crit.font = Font(name="Arial", size=9,
-                              color="375623" if criticas_txt == "✅ Ninguna" else "7B2C2C")
-        cell_crit.fill = PatternFill("solid",
-                                     start_color="E2EFDA" if criticas_txt == "✅ Ninguna" else "FFF5F5",
-                                     end_color="E2EFDA" if criticas_txt == "✅ Ninguna" else "FFF5F5")
-        cell_crit.alignment = Alignment(vertical="top", wrap_text=True)
-        cell_crit.border = _thin_border()
+        is_clean = criticas_txt == "✅ Ninguna"
+        cell_crit.font = _font(9, "375623" if is_clean else "7B2C2C")
+        cell_crit.fill = _fill("E2EFDA" if is_clean else "FFF5F5")
+        cell_crit.alignment = _align(None, "top", True)
+        cell_crit.border = _THIN_BORDER
         cur += 1
 
     # Fila de PROMEDIO GENERAL (usa mvp_valid para consistencia con overall)
     ws.row_dimensions[cur].height = 28
     avg_grand = sum(all_scores) / len(all_scores) if all_scores else 0
-    n_mvp = len(mvp_valid)
-    avg_grand_dims = {
-        d: sum(r.get("scores", {}).get(d, 0) for r in mvp_valid) / n_mvp
-        for d in DIMENSIONS
-    } if n_mvp else {d: 0 for d in DIMENSIONS}
+    _, avg_grand_dims = _score_means(mvp_valid, all_dim_keys)
     ws.merge_cells(f"A{cur}:B{cur}")
-    _data(ws[f"A{cur}"], "▶  PROMEDIO GENERAL", bold=True,
+    _data(ws.cell(row=cur, column=1), "▶  PROMEDIO GENERAL", bold=True,
           bg="1F3864", fc="FFFFFF", align="center", size=10)
 
     fc_g, bg_g = _score_total_color(avg_grand)
-    _data(ws[f"C{cur}"], round(avg_grand, 1), bold=True, align="center",
+    _data(ws.cell(row=cur, column=3), round(avg_grand, 1), bold=True, align="center",
           fc=fc_g, bg=bg_g, size=13)
 
     for dim, col in dim_cols:
         val = round(avg_grand_dims[dim], 1)
         bg_d, fc_d = _score_dim_color(val)
-        _data(ws[f"{col}{cur}"], f"{val}/10", bold=True, align="center",
+        _data(ws.cell(row=cur, column=col), f"{val}/10", bold=True, align="center",
               fc=fc_d, bg=bg_d)
 
-    ws[f"J{cur}"].fill = PatternFill("solid", start_color="1F3864", end_color="1F3864")
+    ws.cell(row=cur, column=10).fill = _BLUE_FILL
     bg_n, fc_n = _nivel_color(score_to_level(avg_grand))
-    _data(ws[f"K{cur}"], score_to_level(avg_grand), bold=True, align="center",
+    _data(ws.cell(row=cur, column=11), score_to_level(avg_grand), bold=True, align="center",
           fc=fc_n, bg=bg_n)
-    ws[f"L{cur}"].fill = PatternFill("solid", start_color="1F3864", end_color="1F3864")
+    ws.cell(row=cur, column=12).fill = _BLUE_FILL
     cur += 2
 
     # ══════════════════════════════════════════════════════════════════════
@@ -1351,63 +2143,51 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
         bg="843C0C")
     cur += 1
 
-    for sheet_idx, (sheet_name, sheet_results) in enumerate(by_sheet.items(), 1):
+    for sheet_idx, (sheet_name, stats) in enumerate(sheet_stats.items(), 1):
         ws.row_dimensions[cur].height = 110
         fill = row_fills[cur % 2]
 
-        avg_dims = {
-            d: sum(r.get("scores", {}).get(d, 0) for r in sheet_results) / len(sheet_results)
-            for d in DIMENSIONS
-        }
+        sheet_results, avg_dims = stats["results"], stats["avg_dims"]
 
         # Las dos dimensiones más débiles
-        sorted_dims = sorted(avg_dims.items(), key=lambda x: x[1])
-        weakest1_dim, weakest1_score = sorted_dims[0]
-        weakest2_dim, weakest2_score = sorted_dims[1] if len(sorted_dims) > 1 else (sorted_dims[0])
+        weakest = heapq.nsmallest(2, avg_dims.items(), key=itemgetter(1))
+        weakest1_dim, weakest1_score = weakest[0]
+        weakest2_dim, weakest2_score = weakest[-1]
 
         # Contar frecuencia de brechas en TODAS las dimensiones
-        brecha_freq: dict[str, int] = {}
+        brecha_freq: Counter[str] = Counter()
         for r in sheet_results:
-            for d in DIMENSIONS:
-                raw = r.get("brechas", {}).get(d, "")
-                if raw and raw not in ("Completo", "", "nan"):
-                    for item in raw.split("|"):
-                        item = item.strip()
-                        if len(item) > 12:
-                            # Clave de agrupación: primeras 70 chars
-                            key = item[:70]
-                            brecha_freq[key] = brecha_freq.get(key, 0) + 1
-
-        top_brechas = sorted(brecha_freq.items(), key=lambda x: x[1], reverse=True)[:6]
+            brechas = r.get("brechas", {})
+            for d in all_dim_keys:
+                brecha_freq.update(_split_brecha(brechas.get(d) or ""))
+
+        top_brechas = brecha_freq.most_common(6)
         brechas_txt = "\n".join(
             f"[{cnt}]  {brecha}" for brecha, cnt in top_brechas
         ) if top_brechas else "✅ Todas las HUs tienen definición suficiente en estas dimensiones"
 
-        _data(ws[f"A{cur}"], sheet_idx, align="center", bg=fill)
-        _data(ws[f"B{cur}"], f"{sheet_name}\n({len(sheet_results)} HUs)",
+        _data(ws.cell(row=cur, column=1), sheet_idx, align="center", bg=fill)
+        _data(ws.cell(row=cur, column=2), f"{sheet_name}\n({stats['n']} HUs)",
               bold=True, bg=fill)
 
         bg_w1, fc_w1 = _score_dim_color(weakest1_score)
-        _data(ws[f"C{cur}"], DIMENSIONS[weakest1_dim], bold=True, fc=fc_w1, bg=bg_w1)
-        _data(ws[f"D{cur}"], f"{weakest1_score:.1f}/10", bold=True,
+        _data(ws.cell(row=cur, column=3), DIMENSIONS[weakest1_dim], bold=True, fc=fc_w1, bg=bg_w1)
+        _data(ws.cell(row=cur, column=4), f"{weakest1_score:.1f}/10", bold=True,
               align="center", fc=fc_w1, bg=bg_w1)
 
         bg_w2, fc_w2 = _score_dim_color(weakest2_score)
-        _data(ws[f"E{cur}"], DIMENSIONS[weakest2_dim], bold=True, fc=fc_w2, bg=bg_w2)
-        _data(ws[f"F{cur}"], f"{weakest2_score:.1f}/10", bold=True,
+        _data(ws.cell(row=cur, column=5), DIMENSIONS[weakest2_dim], bold=True, fc=fc_w2, bg=bg_w2)
+        _data(ws.cell(row=cur, column=6), f"{weakest2_score:.1f}/10", bold=True,
               align="center", fc=fc_w2, bg=bg_w2)
 
-        ws.merge_cells(f"G{cur}:M{cur}")
-        cell = ws[f"G{cur}"]
+        ws.merge_cells(start_row=cur, start_column=7, end_row=cur, end_column=13)  # G:M
+        cell = ws.cell(row=cur, column=7)
         cell.value = _sanitize_for_excel(brechas_txt)
         is_clean = brechas_txt.startswith("✅")
-        cell.font = Font(name="Arial", size=9,
-                         color="375623" if is_clean else "7B2C2C")
-        cell.fill = PatternFill("solid",
-                                start_color="E2EFDA" if is_clean else "FFF5F5",
-                                end_color="E2EFDA" if is_clean else "FFF5F5")
-        cell.alignment = Alignment(vertical="top", wrap_text=True)
-        cell.border = _thin_border()
+        cell.font = _font(9, "375623" if is_clean else "7B2C2C")
+        cell.fill = _fill("E2EFDA" if is_clean else "FFF5F5")
+        cell.alignment = _align(None, "top", True)
+        cell.border = _THIN_BORDER
         cur += 1
 
     cur += 2
@@ -1449,6 +2229,32 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
     ws.freeze_panes = f"C5"
 
 
+def write_results_workbook(input_path: str, output_path: str, results_by_sheet_row: dict[str, dict],
+                           all_results_flat: list[dict], wb=None, log_fn=None) -> None:
+    """
+    Arma y guarda el Excel de salida: columnas de análisis en cada hoja + Síntesis Ejecutiva.
+    wb: workbook con las filas ya escritas (hilo escritor de run()); si es None se carga
+    input_path y se escriben todas las filas aquí.
+    """
+    def _log(msg):
+        if log_fn:
+            log_fn(msg)
+
+    if wb is None:
+        wb = openpyxl.load_workbook(input_path)
+        for sheet_name, row_results in results_by_sheet_row.items():
+            if sheet_name in wb.sheetnames:
+                write_analysis_to_sheet(wb[sheet_name], row_results)
+
+    for sheet_name, row_results in results_by_sheet_row.items():
+        if sheet_name in wb.sheetnames:
+            _log(f"  ✓  {sheet_name}: {len(row_results)} HUs")
+
+    _log("\n📊  Generando Síntesis Ejecutiva...")
+    create_synthesis_sheet(wb, all_results_flat)
+    wb.save(output_path)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # 9. ORQUESTADOR PRINCIPAL
 # ══════════════════════════════════════════════════════════════════════════════
@@ -1456,9 +2262,14 @@ def create_synthesis_sheet(wb, all_results: list[dict]):
 def run(input_path: str, output_path: str,
         target_sheet: str = None, limit: int = None, silent: bool = False,
         previous_analysis_path: str = None,
-        progress_callback=None) -> dict:
+        progress_callback=None, use_cache: bool = True, mode: str = "stream",
+        client: "anthropic.Anthropic" = None) -> dict:
     """
     Ejecuta el análisis de HUs. Retorna un dict con el resumen para uso programático.
+    Con use_cache=True reutiliza análisis guardados en .hu_cache/ para HUs sin cambios.
+    mode="batch" envía las HUs no cacheadas en un solo Message Batch (ver analyze_hus_batch);
+    mode="stream" (default) las analiza una por una con MAX_CONCURRENT_ANALYSIS en paralelo.
+    client: cliente Anthropic ya creado (ej. compartido entre reruns de Streamlit); si no, se crea uno.
     """
     def log(msg=""):
         if not silent:
@@ -1468,21 +2279,23 @@ def run(input_path: str, output_path: str,
     log("  HU ANALYZER — Actinver Digital Products")
     log("═" * 60)
 
-    try:
-        from config import get_api_key
-        api_key = get_api_key()
-    except ImportError:
-        api_key = os.environ.get("ANTHROPIC_API_KEY", "")
-    if not api_key:
-        err = "ANTHROPIC_API_KEY no configurada."
-        if not silent:
-            print(f"\n❌  {err}")
-            print("    Windows:   set ANTHROPIC_API_KEY=sk-ant-...")
-            print("    Mac/Linux: export ANTHROPIC_API_KEY=sk-ant-...")
-            sys.exit(1)
-        raise ValueError(err)
+    if client is None:
+        try:
+            from config import get_api_key
+            api_key = get_api_key()
+        except ImportError:
+            api_key = os.environ.get("ANTHROPIC_API_KEY", "")
+        if not api_key:
+            err = "ANTHROPIC_API_KEY no configurada."
+            if not silent:
+                print(f"\n❌  {err}")
+                print("    Windows:   set ANTHROPIC_API_KEY=sk-ant-...")
+                print("    Mac/Linux: export ANTHROPIC_API_KEY=sk-ant-...")
+                sys.exit(1)
+            raise ValueError(err)
 
-    client = anthropic.Anthropic(api_key=api_key)
+        import anthropic
+        client = anthropic.Anthropic(api_key=api_key)
 
     log(f"\n📂  Cargando: {input_path}")
     _, all_hus = load_all_hus(input_path, target_sheet, quiet=silent)
@@ -1503,106 +2316,276 @@ def run(input_path: str, output_path: str,
         log(f"\n  ⚙  Modo prueba: {len(all_hus)} de {total} HUs")
 
     workers = min(MAX_CONCURRENT_ANALYSIS, len(all_hus))
+    # Límite de tokens de entrada por minuto (opcional): evita cadenas de 429 con HUs largas
+    token_bucket = _TokenBucket(MAX_INPUT_TOKENS_PER_MINUTE) if MAX_INPUT_TOKENS_PER_MINUTE > 0 else None
     total_hus = len(all_hus)
     log(f"\n🔍  Analizando {total_hus} HUs con Claude AI ({workers} en paralelo)...\n")
 
     hu_speed = get_hu_speed()
     if progress_callback:
         eta = (total_hus * (hu_speed or 15)) / workers if hu_speed else None
-        progress_callback(0, total_hus, hu_speed or 0, 0, eta or 0)
+        progress_callback(0, total_hus, hu_speed or 0, 0, eta or 0, 0)
 
-    def _analyze_one(args):
-        client_ref, idx, hu, prev = args
-        result = analyze_hu(client_ref, hu, prev_data=prev)
+    def _tag_result(result: dict, hu: dict) -> dict:
         result["_sheet"] = hu["_sheet"]
         result["_row"] = hu["_row"]
         result["_hu_id"] = hu["_hu_id"]
         result["_is_mvp"] = hu.get("_is_mvp", True)
-        return (idx, result)
+        return result
+
+    def _analyze_group(client_ref, group: list[tuple[int, dict, dict]]) -> dict[int, dict]:
+        """Caché primero; las HUs del grupo sin caché van en una sola llamada (analyze_hu_group)."""
+        out: dict[int, dict] = {}
+        misses = []
+        for idx, hu, prev in group:
+            cache_key = _hu_cache_key(hu, prev) if use_cache else None
+            result = get_cached_analysis(cache_key) if cache_key else None
+            if result is not None:
+                result["_cached"] = True
+                out[idx] = _tag_result(result, hu)
+            else:
+                misses.append((idx, hu, prev, cache_key))
+        if misses:
+            items = [(hu, prev) for _, hu, prev, _ in misses]
+            if token_bucket is not None:
+                token_bucket.acquire(_estimate_input_tokens(items))
+            analyzed = analyze_hu_group(client_ref, items)
+            for (idx, hu, _, cache_key), result in zip(misses, analyzed):
+                if cache_key:
+                    save_cached_analysis(cache_key, result)
+                out[idx] = _tag_result(result, hu)
+        return out
 
     results_by_idx: dict[int, dict] = {}
     completed = 0
+    cache_read_tokens = 0      # tokens servidos desde el prompt cache de Anthropic
+    cache_creation_tokens = 0  # tokens escritos al prompt cache (primera llamada con cada prefijo)
+    cache_hits = 0         # HUs servidas desde .hu_cache/ (sin llamar a Claude)
     future_to_start: dict = {}
 
-    with ThreadPoolExecutor(max_workers=workers) as executor:
+    # Cada resultado se guarda y se manda al hilo escritor (el Excel se arma mientras se analiza)
+    write_queue, writer_thread, writer_state = _start_workbook_writer(input_path)
+    try:
+        def _store(idx: int, result: dict) -> None:
+            results_by_idx[idx] = result
+            write_queue.put(result)
+
+        # HUs con el mismo contenido (ej. la misma HU pegada en varias iniciativas) se analizan
+        # una sola vez; el resultado se replica a las demás filas.
+        unique_items: list[tuple[int, dict, dict]] = []
+        duplicates: dict[int, list[tuple[int, dict]]] = {}
+        first_by_key: dict[str, int] = {}
         for idx, hu in enumerate(all_hus, 1):
             prev = _find_prev_data(hu, prev_index)
-            fut = executor.submit(_analyze_one, (client, idx, hu, prev))
-            future_to_start[fut] = (idx, hu, time.time())
-
-        for future in as_completed(future_to_start):
-            idx, hu, start_time = future_to_start[future]
-            elapsed = time.time() - start_time
-            completed += 1
+            key = _hu_content_key(hu, prev)
+            if key in first_by_key:
+                duplicates[first_by_key[key]].append((idx, hu))
+            else:
+                first_by_key[key] = idx
+                duplicates[idx] = []
+                unique_items.append((idx, hu, prev))
+        dup_count = total_hus - len(unique_items)
+        if dup_count:
+            log(f"  🔁  {dup_count} HUs repetidas: se analizan {len(unique_items)} únicas")
+
+        def _fan_out(idx: int, result: dict) -> int:
+            """Copia el resultado de una HU a sus repetidas. Retorna cuántas copias hizo."""
+            for dup_idx, dup_hu in duplicates.get(idx, []):
+                _store(dup_idx, _tag_result(dict(result), dup_hu))
+            return len(duplicates.get(idx, []))
+
+        # HUs idénticas a las del análisis anterior: se reutiliza ese resultado sin llamar a Claude
+        reused_hus = 0
+        prev_by_content = prev_index.get("by_content") if use_cache and REUSE_UNCHANGED_PREVIOUS else None
+        if prev_by_content:
+            to_analyze = []
+            for idx, hu, prev in unique_items:
+                prev_result = prev_by_content.get(_hu_content_key(hu))
+                if prev_result is None:
+                    to_analyze.append((idx, hu, prev))
+                    continue
+                result = _tag_result(_reuse_previous_result(prev_result), hu)
+                _store(idx, result)
+                reused_hus += 1 + _fan_out(idx, result)
+            unique_items = to_analyze
+            if reused_hus:
+                log(f"  ♻  {reused_hus} HUs sin cambios vs el análisis anterior: se reutiliza su resultado")
+                completed = reused_hus
+                if progress_callback:
+                    progress_callback(completed, total_hus, hu_speed or 0, 0, 0, cache_read_tokens)
+
+        # Pocas HUs: el batch tarda minutos en procesarse; en modo normal terminan antes
+        if mode == "batch" and len(unique_items) <= _BATCH_FALLBACK_MAX_HUS:
+            log(f"  ⚙  {len(unique_items)} HUs: se analizan en modo normal en lugar de Message Batch")
+            mode = "stream"
+
+        stream_items = unique_items  # HUs para el modo normal (ThreadPool)
+        if mode == "batch":
+            # Caché primero; solo las HUs nuevas o modificadas van al batch
+            pending = []
+            for idx, hu, prev in unique_items:
+                cache_key = _hu_cache_key(hu, prev) if use_cache else None
+                result = get_cached_analysis(cache_key) if cache_key else None
+                if result is not None:
+                    result["_cached"] = True
+                    _store(idx, _tag_result(result, hu))
+                    cache_hits += 1 + _fan_out(idx, result)
+                else:
+                    pending.append((idx, hu, prev, cache_key))
+            log(f"  📦  Message Batch: {len(pending)} HUs ({cache_hits} desde caché)")
+            # Ya terminadas: reutilizadas, cacheadas y sus repetidas. Las repetidas de las HUs
+            # pendientes se cuentan cuando el batch devuelve su resultado.
+            completed = len(results_by_idx)
+
+            batch_start = time.time()
+
+            def _batch_progress(done: int):
+                if not progress_callback:
+                    return
+                elapsed_b = time.time() - batch_start
+                speed = elapsed_b / done if done else (hu_speed or 0)
+                remaining = len(pending) - done
+                progress_callback(completed + done, total_hus, speed, 0,
+                                  remaining * speed if done and remaining > 0 else 0, cache_read_tokens)
 
             try:
-                _, result = future.result()
-                results_by_idx[idx] = result
-                score = result.get("score_total", 0)
-                nivel = result.get("nivel", "?")
-                title = hu.get("Titulo", hu.get("Titulo ", "Sin título"))[:50]
-                log(f"  [{completed:3}/{total_hus}]  {hu['_sheet']:20} | {hu['_hu_id']:10} | {title}")
-                log(f"             → {nivel}  ({score:.0f}/100)")
+                batch_results = analyze_hus_batch(
+                    client, [(idx, hu, prev) for idx, hu, prev, _ in pending], progress_fn=_batch_progress
+                ) if pending else {}
             except AnthropicGameOverError:
                 raise
             except Exception as e:
-                results_by_idx[idx] = _error_result(str(e))
-                results_by_idx[idx]["_sheet"] = hu["_sheet"]
-                results_by_idx[idx]["_row"] = hu["_row"]
-                results_by_idx[idx]["_hu_id"] = hu["_hu_id"]
-                results_by_idx[idx]["_is_mvp"] = hu.get("_is_mvp", True)
-                log(f"  [{completed:3}/{total_hus}]  {hu['_sheet']:20} | {hu['_hu_id']:10} | ⛔ Error: {e}")
-
-            hu_speed = update_hu_speed(elapsed)
-            if progress_callback:
-                remaining = total_hus - completed
-                eta = (remaining * hu_speed / workers) if hu_speed and remaining > 0 else 0
-                progress_callback(completed, total_hus, hu_speed or 0, elapsed, eta)
-
-    results_by_sheet_row: dict[str, dict] = {}
-    all_results_flat = [results_by_idx[i] for i in range(1, len(all_hus) + 1)]
-    for r in all_results_flat:
-        results_by_sheet_row.setdefault(r["_sheet"], {})[r["_row"]] = r
-
-    log(f"\n💾  Escribiendo: {output_path}")
-    wb = openpyxl.load_workbook(input_path)
+                # Batches API no disponible o con error: las HUs pendientes siguen en modo normal
+                log(f"  ⚠  Message Batch falló ({e}); se analizan en modo normal")
+                batch_results = None
 
-    for sheet_name, row_results in results_by_sheet_row.items():
-        if sheet_name not in wb.sheetnames:
-            continue
-        write_analysis_to_sheet(wb[sheet_name], row_results)
-        log(f"  ✓  {sheet_name}: {len(row_results)} HUs")
-
-    log("\n📊  Generando Síntesis Ejecutiva...")
-    create_synthesis_sheet(wb, all_results_flat)
-    wb.move_sheet("📊 Síntesis Ejecutiva", offset=-(len(wb.sheetnames) - 1))
-    wb.save(output_path)
+            if batch_results is None:
+                stream_items = [(idx, hu, prev) for idx, hu, prev, _ in pending]
+                completed = len(results_by_idx)  # cacheadas y sus repetidas
+            else:
+                # HUs sin análisis válido en el batch: siguen en modo normal (pool, token bucket, progreso)
+                stream_items = []
+                for idx, hu, prev, cache_key in pending:
+                    if idx not in batch_results:
+                        stream_items.append((idx, hu, prev))
+                        continue
+                    result = _tag_result(batch_results[idx], hu)
+                    if cache_key:
+                        save_cached_analysis(cache_key, result)
+                    _store(idx, result)
+                    _fan_out(idx, result)
+                    cache_read_tokens += result.get("_cache_read_tokens", 0)
+                    cache_creation_tokens += result.get("_cache_creation_tokens", 0)
+                    log(f"  {hu['_sheet']:20} | {hu['_hu_id']:10} → {result.get('nivel', '?')}  ({result.get('score_total', 0):.0f}/100)")
+                completed = len(results_by_idx)  # las HUs devueltas al modo normal se cuentan al terminar
+                if stream_items:
+                    log(f"  ↻  {len(stream_items)} HUs sin análisis válido en el batch: se analizan en modo normal")
+                if progress_callback:
+                    progress_callback(completed, total_hus, hu_speed or 0, time.time() - batch_start, 0, cache_read_tokens)
+
+        if stream_items:
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+
+            # HUS_PER_REQUEST > 1: varias HUs por llamada (system prompt e instrucciones una vez por grupo)
+            group_size = max(1, HUS_PER_REQUEST)
+            groups = [stream_items[i:i + group_size] for i in range(0, len(stream_items), group_size)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for group in groups:
+                    fut = executor.submit(_analyze_group, client, group)
+                    future_to_start[fut] = (group, time.time())
+
+                for future in as_completed(future_to_start):
+                    group, start_time = future_to_start[future]
+                    elapsed = (time.time() - start_time) / len(group)  # segundos por HU
+                    group_results, group_error = None, None
+                    try:
+                        group_results = future.result()
+                    except AnthropicGameOverError:
+                        # Sin créditos: cancelar las HUs en cola en vez de esperar a que cada una falle
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    except Exception as e:
+                        group_error = e
+
+                    for idx, hu, _ in group:
+                        completed += 1
+                        from_cache = False
+                        try:
+                            if group_error is not None:
+                                raise group_error
+                            result = group_results[idx]
+                            _store(idx, result)
+                            copies = _fan_out(idx, result)
+                            completed += copies
+                            from_cache = result.get("_cached", False)
+                            cache_hits += from_cache * (1 + copies)
+                            cache_read_tokens += result.get("_cache_read_tokens", 0)
+                            cache_creation_tokens += result.get("_cache_creation_tokens", 0)
+                            score = result.get("score_total", 0)
+                            nivel = result.get("nivel", "?")
+                            title = hu.get("Titulo", hu.get("Titulo ", "Sin título"))[:50]
+                            log(f"  [{completed:3}/{total_hus}]  {hu['_sheet']:20} | {hu['_hu_id']:10} | {title}")
+                            log(f"             → {nivel}  ({score:.0f}/100){'  [caché]' if from_cache else ''}")
+                        except Exception as e:
+                            result = _tag_result(_error_result(str(e)), hu)
+                            _store(idx, result)
+                            completed += _fan_out(idx, result)
+                            log(f"  [{completed:3}/{total_hus}]  {hu['_sheet']:20} | {hu['_hu_id']:10} | ⛔ Error: {e}")
+
+                        if not from_cache:
+                            hu_speed = update_hu_speed(elapsed)
+                        if progress_callback:
+                            remaining = total_hus - completed
+                            eta = (remaining * hu_speed / workers) if hu_speed and remaining > 0 else 0
+                            progress_callback(completed, total_hus, hu_speed or 0, elapsed, eta, cache_read_tokens)
+
+        _flush_speed()  # persistir el HU Speed de esta corrida (la UI lo lee en la siguiente)
+
+        if cache_hits:
+            log(f"\n  ♻  {cache_hits} HUs reutilizadas desde caché (sin llamar a Claude)")
+        if cache_read_tokens or cache_creation_tokens:
+            log(f"  ⚡  Prompt cache: {cache_read_tokens:,} tokens leídos, {cache_creation_tokens:,} escritos")
+
+        results_by_sheet_row: dict[str, dict] = defaultdict(dict)
+        all_results_flat = [results_by_idx[i] for i in range(1, len(all_hus) + 1)]
+        for r in all_results_flat:
+            results_by_sheet_row[r["_sheet"]][r["_row"]] = r
+
+        log(f"\n💾  Escribiendo: {output_path}")
+    finally:
+        # Siempre liberar el hilo escritor, también si algo falla antes (caché, matching, sin créditos):
+        # si no, queda bloqueado en la cola con una copia completa del workbook cargada.
+        write_queue.put(None)
+        writer_thread.join()
+
+    if writer_state["wb"] is None:
+        # El hilo escritor falló: write_results_workbook escribe todas las filas, como antes
+        log(f"  ⚠  Escritura incremental falló ({writer_state['error']}); se escribe al final")
+    write_results_workbook(input_path, output_path, results_by_sheet_row, all_results_flat,
+                           wb=writer_state["wb"], log_fn=log)
 
     valid = [r for r in all_results_flat if r.get("score_total", 0) > 0]
-    avg = sum(r["score_total"] for r in valid) / len(valid) if valid else 0
-    criticas    = sum(1 for r in valid if r["score_total"] < 30)
-    incompletas = sum(1 for r in valid if 30 <= r["score_total"] < 55)
-    excelentes  = sum(1 for r in valid if r["score_total"] >= 90)
-    completas   = sum(1 for r in valid if 75 <= r["score_total"] < 90)
-    aceptables  = sum(1 for r in valid if 55 <= r["score_total"] < 75)
+    valid_scores = [r["score_total"] for r in valid]
+    avg = sum(valid_scores) / len(valid_scores) if valid_scores else 0
+    # Un bisect por HU sobre los mismos cortes de nivel (30/55/75/90) en vez de cinco pasadas
+    buckets = Counter(bisect.bisect_right(_SCORE_THRESHOLDS, s) for s in valid_scores)
+    criticas, incompletas, aceptables, completas, excelentes = (buckets[i] for i in range(5))
 
     # Para síntesis ejecutiva: solo HUs MVP/Fase 1 (si existe columna)
     has_mvp_filter = any(not r.get("_is_mvp", True) for r in valid)
     mvp_valid = [r for r in valid if r.get("_is_mvp", True)] if has_mvp_filter else valid
 
-    by_sheet = {}
+    # Una sola pasada por hoja: agrupa para la síntesis ejecutiva y acumula la suma de scores
     by_sheet_full: dict[str, list[dict]] = {}
+    score_sums: dict[str, float] = defaultdict(float)
     for r in mvp_valid:
         s = r.get("_sheet", "Sin hoja")
-        if s not in by_sheet:
-            by_sheet[s] = {"count": 0, "avg": 0, "scores": []}
-            by_sheet_full[s] = []
-        by_sheet[s]["count"] += 1
-        by_sheet[s]["scores"].append(r["score_total"])
-        by_sheet_full[s].append(r)
-    for s, d in by_sheet.items():
-        d["avg"] = round(sum(d["scores"]) / len(d["scores"]), 1) if d["scores"] else 0
-        del d["scores"]
+        by_sheet_full.setdefault(s, []).append(r)
+        score_sums[s] += r["score_total"]
+    by_sheet = {
+        s: {"count": len(rs), "avg": round(score_sums[s] / len(rs), 1)}
+        for s, rs in by_sheet_full.items()
+    }
 
     log("\n📋  Generando análisis ejecutivo por iniciativa...")
     if has_mvp_filter:
@@ -1632,6 +2615,10 @@ def run(input_path: str, output_path: str,
         "by_sheet": by_sheet,
         "executive_by_initiative": executive_by_initiative,
         "output_path": output_path,
+        "cache_hits": cache_hits,
+        "reused_previous": reused_hus,
+        "cache_read_tokens": cache_read_tokens,
+        "cache_creation_tokens": cache_creation_tokens,
     }
 
 
@@ -1653,10 +2640,15 @@ if __name__ == "__main__":
                         help="Limitar a N HUs para pruebas")
     parser.add_argument("--previous", "-p", default=None,
                         help="Excel del análisis anterior para comparar mejoras")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="No usar ni guardar análisis en .hu_cache/ (fuerza llamar a Claude)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Usar Message Batches API (50%% del costo; la respuesta puede tardar minutos)")
 
     args = parser.parse_args()
 
     if not args.output:
         args.output = get_next_output_path(args.input)
 
-    run(args.input, args.output, args.sheet, args.limit, previous_analysis_path=args.previous)
+    run(args.input, args.output, args.sheet, args.limit, previous_analysis_path=args.previous,
+        use_cache=not args.no_cache, mode="batch" if args.batch else "stream")
@@ -4,12 +4,17 @@ Extrae tablas o contenido estructurado y genera una hoja compatible con hu_analy
 También: consolidación de múltiples Excels en uno solo.
 """
 
+import io
+import multiprocessing
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from docx import Document
 from docx.table import Table
 import openpyxl
 from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
 
 # Columnas estándar para HUs (orden y nombres esperados por hu_analyzer)
 STANDARD_HEADERS = [
@@ -68,17 +73,59 @@ CRITERIA_KEYWORDS = ("criterios", "aceptación", "aceptacion")
 REGLA_KEYWORDS = ("reglas", "negocio")
 MVP_FASE_KEYWORDS = ("fase", "mvp", "alcance")
 NOTES_KEYWORDS = ("notas", "observaciones", "comentarios")
+ID_KEYWORDS = ("id", "hu", "código", "codigo", "no.")
+
+# Categoría → palabras clave; un header pertenece a la categoría si contiene alguna
+_KEYWORD_CATEGORIES = (
+    ("id", ID_KEYWORDS),
+    ("titulo", TITLE_KEYWORDS),
+    ("desc", DESC_KEYWORDS),
+    ("criterios", CRITERIA_KEYWORDS),
+    ("regla", REGLA_KEYWORDS),
+    ("fase", MVP_FASE_KEYWORDS),
+    ("notas", NOTES_KEYWORDS),
+)
+# Orden de búsqueda por categoría en _find_best_common_column:
+# (categoría de la clave del Word, categoría que debe tener la columna común)
+_COLUMN_FALLBACKS = (
+    ("id", "id"),
+    ("titulo", "titulo"),
+    ("desc", "desc"),
+    ("criterios", "criterios"),
+    ("regla", "reglas_negocio"),
+    ("regla", "criterios"),
+    ("fase", "fase_mvp"),
+    ("notas", "notas"),
+)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
 
 
+@lru_cache(maxsize=1024)
 def _normalize_header(h: str) -> str:
-    """Normaliza nombre de columna para matching."""
-    return re.sub(r"\s+", " ", str(h or "").strip().lower())
+    """Normaliza nombre de columna para matching (cacheado: los mismos headers se repiten por fila)."""
+    return _WHITESPACE_RE.sub(" ", str(h or "").strip().lower())
 
 
-def _map_header(raw: str) -> str:
-    """Mapea header de Word a columna estándar."""
-    n = _normalize_header(raw)
-    return HEADER_ALIASES.get(n, raw.strip() if raw else "")
+@lru_cache(maxsize=1024)
+def _keyword_categories(normalized: str) -> frozenset[str]:
+    """Categorías de _KEYWORD_CATEGORIES presentes en un header ya normalizado (una pasada por header)."""
+    cats = {cat for cat, keywords in _KEYWORD_CATEGORIES if any(k in normalized for k in keywords)}
+    if "reglas" in normalized and "negocio" in normalized:
+        cats.add("reglas_negocio")
+    if "fase" in normalized or "mvp" in normalized:
+        cats.add("fase_mvp")
+    return frozenset(cats)
+
+
+def _normalize_headers(headers: list[str]) -> list[tuple[str, str, frozenset[str]]]:
+    """(normalizado, original, categorías) para no re-normalizar ni re-clasificar los headers comunes en cada búsqueda."""
+    result = []
+    for h in headers:
+        c = _normalize_header(h)
+        result.append((c, h, _keyword_categories(c)))
+    return result
 
 
 def _extract_from_tables(doc: Document) -> tuple[list[str], list[dict]]:
@@ -98,20 +145,10 @@ def _extract_from_tables(doc: Document) -> tuple[list[str], list[dict]]:
         if not raw_headers or not any(raw_headers):
             continue
 
-        # Mapear a estándar; si no hay ID explícito, usar primera columna
-        headers = []
-        id_col_idx = None
-        for i, h in enumerate(raw_headers):
-            mapped = _map_header(h)
-            if mapped:
-                headers.append(mapped)
-                if mapped == "ID" or (not id_col_idx and i == 0):
-                    id_col_idx = len(headers) - 1
-            else:
-                headers.append(h or f"Col_{i}")
-
-        if id_col_idx is None:
-            id_col_idx = 0
+        # Mapear a estándar (una normalización + un get por header); si no hay ID explícito,
+        # usar primera columna
+        headers = [HEADER_ALIASES.get(_normalize_header(h), h) or f"Col_{i}" for i, h in enumerate(raw_headers)]
+        id_col_idx = max((i for i, h in enumerate(headers) if h == "ID"), default=0)
 
         # Filas de datos
         for row in table.rows[1:]:
@@ -145,6 +182,22 @@ SECTION_PATTERN = re.compile(
     r"^(titulo|título|descripción|descripcion|criterios|reglas de negocio|fase|fase 1|mvp|notas|observaciones|definición|definicion)\s*:?\s*(.*)$",
     re.IGNORECASE
 )
+# Iniciales posibles de SECTION_PATTERN: filtro barato antes de invocar la regex
+_SECTION_INITIALS = frozenset("tdcrfmno")
+
+# Patrones para detectar inicio de nueva HU
+HU_PATTERN = re.compile(
+    r"^(?:HU[- ]?)?(\d+)|^Historia\s+(?:de\s+usuario\s+)?(\d+)|^(\d+)\.\s",
+    re.IGNORECASE
+)
+
+
+def _may_start_hu(text: str) -> bool:
+    """Prefiltro de HU_PATTERN: solo puede coincidir si empieza por dígito, "HU" o "Historia"."""
+    if text[0].isdigit():
+        return True
+    head = text[:8].lower()
+    return head.startswith("hu") or head == "historia"
 
 
 def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[str], list[dict]]:
@@ -158,6 +211,8 @@ def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[
     current = {}
     current_id = ""
     buffer = []
+    # Texto de todos los párrafos no vacíos, para el fallback sin recorrer doc.paragraphs otra vez
+    all_text_parts = []
 
     def _map_section_key(match_key: str) -> str:
         k = match_key.lower().strip()
@@ -199,18 +254,13 @@ def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[
         current_id = ""
         buffer = []
 
-    # Patrones para detectar inicio de nueva HU
-    hu_pattern = re.compile(
-        r"^(?:HU[- ]?)?(\d+)|^Historia\s+(?:de\s+usuario\s+)?(\d+)|^(\d+)\.\s",
-        re.IGNORECASE
-    )
-
     for para in doc.paragraphs:
         text = para.text.strip()
         if not text:
             continue
+        all_text_parts.append(text)
 
-        match = hu_pattern.match(text)
+        match = HU_PATTERN.match(text) if _may_start_hu(text) else None
         if match:
             flush_hu()
             g = match.groups()
@@ -219,7 +269,7 @@ def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[
                 buffer = [text[len(match.group(0)):].strip()] if len(match.group(0)) < len(text) else []
             continue
 
-        section_match = SECTION_PATTERN.match(text)
+        section_match = SECTION_PATTERN.match(text) if text[0].lower() in _SECTION_INITIALS else None
         if section_match:
             if current_id:
                 key = _map_section_key(section_match.group(1))
@@ -244,7 +294,7 @@ def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[
 
     if not hus:
         # Fallback: todo el documento como una HU
-        full_text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
+        full_text = "\n".join(all_text_parts)
         if full_text:
             hus = [{
                 "ID": "HU-1",
@@ -259,63 +309,67 @@ def _extract_from_paragraphs(doc: Document, initiative_name: str) -> tuple[list[
     return headers, hus
 
 
-def _find_best_common_column(word_key: str, common_headers: list[str]) -> str | None:
+def _find_best_common_column(word_key: str, common_headers: list[str],
+                             normalized: list[tuple[str, str, frozenset[str]]] = None) -> str | None:
     """
     Encuentra la columna común que mejor coincide con la clave del Word.
     Usa matching por palabras clave para mapear ID, Titulo, Descripción, etc.
+    normalized: salida de _normalize_headers(common_headers), precalculada por el llamador.
     """
     w = _normalize_header(word_key)
     if not w:
         return None
+    if normalized is None:
+        normalized = _normalize_headers(common_headers)
     # Match exacto o por alias
-    for common in common_headers:
-        c = _normalize_header(common)
+    for c, common, _ in normalized:
         if not c:
             continue
         if w == c or w in c or c in w:
             return common
     # Match por palabras clave
-    if any(k in w for k in ("id", "hu", "código", "codigo", "no.")):
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in ("id", "hu", "código", "codigo", "no.")):
-                return h
-    if any(k in w for k in TITLE_KEYWORDS):
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in TITLE_KEYWORDS):
-                return h
-    if any(k in w for k in DESC_KEYWORDS):
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in DESC_KEYWORDS):
-                return h
-    if any(k in w for k in CRITERIA_KEYWORDS):
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in CRITERIA_KEYWORDS):
-                return h
-    if any(k in w for k in REGLA_KEYWORDS):
-        for h in common_headers:
-            ch = _normalize_header(h)
-            if "reglas" in ch and "negocio" in ch:
-                return h
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in CRITERIA_KEYWORDS):
-                return h
-    if any(k in w for k in MVP_FASE_KEYWORDS):
-        for h in common_headers:
-            ch = _normalize_header(h)
-            if "fase" in ch or "mvp" in ch:
-                return h
-    if any(k in w for k in NOTES_KEYWORDS):
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in NOTES_KEYWORDS):
-                return h
+    w_cats = _keyword_categories(w)
+    if not w_cats:
+        return None
+    for w_cat, common_cat in _COLUMN_FALLBACKS:
+        if w_cat in w_cats:
+            for _, h, cats in normalized:
+                if common_cat in cats:
+                    return h
     return None
 
 
-def _map_word_hu_to_common_format(word_row: dict, common_headers: list[str], word_headers: list[str]) -> dict:
+def _build_common_column_map(word_headers: list[str], common_headers: list[str]) -> dict:
+    """
+    Resuelve una sola vez por documento a qué columna común va cada encabezado del Word
+    (None = sin columna directa). Evita repetir el matching por palabras clave en cada fila.
+    """
+    normalized = _normalize_headers(common_headers)
+    return {wh: _find_best_common_column(wh, common_headers, normalized) for wh in word_headers}
+
+
+def _fallback_desc_column(common_headers: list[str]) -> str:
+    """Columna donde se acumula el contenido del Word que no tiene columna común directa."""
+    for _, h, cats in _normalize_headers(common_headers):
+        if "desc" in cats:
+            return h
+    return common_headers[2] if len(common_headers) > 2 else common_headers[-1]
+
+
+def _map_word_hu_to_common_format(
+    word_row: dict,
+    common_headers: list[str],
+    word_headers: list[str],
+    column_map: dict = None,
+    desc_col: str = None,
+) -> dict:
     """
     Mapea una HU del Word al formato común del Excel.
     Preserva toda la información: contenido sin columna directa va a Descripción o columna más apropiada.
+    column_map / desc_col: precalculados por documento (ver _build_common_column_map).
     """
+    if column_map is None:
+        column_map = _build_common_column_map(word_headers, common_headers)
     result = {h: "" for h in common_headers}
     unmapped_content = []
 
@@ -323,7 +377,7 @@ def _map_word_hu_to_common_format(word_row: dict, common_headers: list[str], wor
         if not val or not str(val).strip():
             continue
         val_str = str(val).strip()
-        common_col = _find_best_common_column(wh, common_headers)
+        common_col = column_map[wh] if wh in column_map else _find_best_common_column(wh, common_headers)
         if common_col:
             existing = result.get(common_col, "")
             if existing:
@@ -334,13 +388,8 @@ def _map_word_hu_to_common_format(word_row: dict, common_headers: list[str], wor
             unmapped_content.append(f"[{wh}]\n{val_str}")
 
     if unmapped_content:
-        desc_col = None
-        for h in common_headers:
-            if any(k in _normalize_header(h) for k in DESC_KEYWORDS):
-                desc_col = h
-                break
         if not desc_col:
-            desc_col = common_headers[2] if len(common_headers) > 2 else common_headers[-1]
+            desc_col = _fallback_desc_column(common_headers)
         extra = "\n\n---\n".join(unmapped_content)
         existing = result.get(desc_col, "")
         result[desc_col] = (existing + "\n\n" + extra) if existing else extra
@@ -351,10 +400,10 @@ def _map_word_hu_to_common_format(word_row: dict, common_headers: list[str], wor
 def word_to_hus(docx_path: str, initiative_name: str = None) -> tuple[list[str], list[dict]]:
     """
     Convierte un .docx a estructura de HUs (headers, list[dict]).
+    docx_path: ruta o file-like (BytesIO) del documento.
     initiative_name: nombre para la hoja/iniciativa (por defecto: nombre del archivo).
     """
-    if not initiative_name:
-        import os
+    if not initiative_name and isinstance(docx_path, str):
         initiative_name = os.path.splitext(os.path.basename(docx_path))[0]
 
     doc = Document(docx_path)
@@ -384,6 +433,19 @@ def word_to_hus(docx_path: str, initiative_name: str = None) -> tuple[list[str],
     return final_headers, rows
 
 
+# Estilo de la fila de headers: un solo objeto compartido por todas las celdas
+_HEADER_FONT = Font(bold=True, name="Arial", size=10)
+_HEADER_ALIGN = Alignment(wrap_text=True, vertical="center")
+_DATA_ROW_HEIGHT = 80
+_COLUMN_WIDTH = 25
+
+
+@lru_cache(maxsize=8)
+def _column_letters(n_cols: int) -> tuple[str, ...]:
+    """Letras de las columnas 1..n_cols (las hojas de un mismo lote comparten número de headers)."""
+    return tuple(get_column_letter(i) for i in range(1, n_cols + 1))
+
+
 def create_excel_sheet_from_word(
     wb: openpyxl.Workbook,
     sheet_name: str,
@@ -405,22 +467,60 @@ def create_excel_sheet_from_word(
     # Fila 8: headers
     for col_idx, h in enumerate(headers, 1):
         cell = ws.cell(row=HEADER_ROW, column=col_idx, value=h)
-        cell.font = Font(bold=True, name="Arial", size=10)
-        cell.alignment = Alignment(wrap_text=True, vertical="center")
+        cell.font = _HEADER_FONT
+        cell.alignment = _HEADER_ALIGN
 
-    # Filas de datos (sanitizar para evitar caracteres que rompen Excel)
+    # Filas de datos (sanitizar para evitar caracteres que rompen Excel): ws.append escribe
+    # cada fila de una vez a partir de la siguiente a los headers
     from hu_analyzer import _sanitize_for_excel
-    for row_idx, row in enumerate(rows, DATA_START_ROW):
-        for col_idx, h in enumerate(headers, 1):
-            val = row.get(h, "")
-            raw = str(val) if val else ""
-            ws.cell(row=row_idx, column=col_idx, value=_sanitize_for_excel(raw))
-        ws.row_dimensions[row_idx].height = 80
+    for _ in range(DATA_START_ROW - HEADER_ROW - 1):
+        ws.append(())
+    for row in rows:
+        ws.append([_sanitize_for_excel(str(val)) if (val := row.get(h)) else "" for h in headers])
+
+    # Alto de filas de datos y ancho de columnas, en un solo paso cada uno después de escribir
+    row_dims = ws.row_dimensions
+    for row_idx in range(DATA_START_ROW, DATA_START_ROW + len(rows)):
+        row_dims[row_idx].height = _DATA_ROW_HEIGHT
+    col_dims = ws.column_dimensions
+    for letter in _column_letters(len(headers)):
+        col_dims[letter].width = _COLUMN_WIDTH
 
-    # Ajustar anchos de columna
-    from openpyxl.utils import get_column_letter
-    for col_idx in range(1, len(headers) + 1):
-        ws.column_dimensions[get_column_letter(col_idx)].width = 25
+
+def _safe_sheet_name(name: str) -> str:
+    """Nombre de hoja válido para Excel (máx 31 chars, sin caracteres prohibidos)."""
+    return re.sub(r'[\\/*?:\[\]]', '_', name)[:31]
+
+
+def _word_sheet_rows(docx_source, initiative_name: str, common_headers: list[str] = None):
+    """Extrae las HUs del Word y, si hay common_headers, las mapea al formato común."""
+    word_headers, word_rows = word_to_hus(docx_source, initiative_name)
+    if not word_rows:
+        raise ValueError("No se encontraron HUs en el documento Word.")
+    if common_headers:
+        column_map = _build_common_column_map(word_headers, common_headers)
+        desc_col = _fallback_desc_column(common_headers)
+        rows = [
+            _map_word_hu_to_common_format(r, common_headers, word_headers, column_map, desc_col)
+            for r in word_rows
+        ]
+        return common_headers, rows
+    return word_headers, word_rows
+
+
+def _empty_workbook() -> openpyxl.Workbook:
+    """Workbook nuevo sin la hoja "Sheet" por defecto (la primera hoja creada queda activa)."""
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    return wb
+
+
+def _workbook_to_bytes(wb: openpyxl.Workbook) -> io.BytesIO:
+    """Guarda el workbook en memoria y retorna el BytesIO posicionado al inicio."""
+    bio = io.BytesIO()
+    wb.save(bio)
+    bio.seek(0)
+    return bio
 
 
 def add_word_as_sheet_to_excel(
@@ -435,87 +535,206 @@ def add_word_as_sheet_to_excel(
     del Word al formato común para que coincida con las otras iniciativas.
     Si el Excel no existe, lo crea. Retorna la ruta del Excel.
     """
-    import os
-
-    word_headers, word_rows = word_to_hus(docx_path, initiative_name)
-    if not word_rows:
-        raise ValueError("No se encontraron HUs en el documento Word.")
-
-    if common_headers and os.path.exists(excel_path):
-        rows = [_map_word_hu_to_common_format(r, common_headers, word_headers) for r in word_rows]
-        headers = common_headers
-    else:
-        headers = word_headers
-        rows = word_rows
+    exists = os.path.exists(excel_path)
+    headers, rows = _word_sheet_rows(docx_path, initiative_name, common_headers if exists else None)
 
     name = initiative_name or os.path.splitext(os.path.basename(docx_path))[0]
-    sheet_name = re.sub(r'[\\/*?:\[\]]', '_', name)[:31]
-
-    if os.path.exists(excel_path):
-        wb = openpyxl.load_workbook(excel_path)
-    else:
-        wb = openpyxl.Workbook()
+    sheet_name = _safe_sheet_name(name)
 
+    wb = openpyxl.load_workbook(excel_path) if exists else _empty_workbook()
     create_excel_sheet_from_word(wb, sheet_name, headers, rows)
-
-    # Si es workbook nuevo, quitar hoja por defecto vacía
-    if not os.path.exists(excel_path) and len(wb.worksheets) > 1:
-        for ws in list(wb.worksheets):
-            if ws.title != sheet_name:
-                wb.remove(ws)
-                break
     wb.save(excel_path)
     return excel_path
 
 
-def _copy_sheet(source_ws, target_wb: openpyxl.Workbook, sheet_name: str) -> None:
-    """Copia una hoja de un workbook a otro (valores y dimensiones)."""
+def add_word_as_sheet_to_excel_bytes(
+    excel_bio: io.BytesIO,
+    docx_bytes: bytes,
+    initiative_name: str,
+    common_headers: list[str] = None,
+) -> io.BytesIO:
+    """
+    Igual que add_word_as_sheet_to_excel pero en memoria: recibe el Excel como BytesIO
+    y el Word como bytes (ej. uploaded.getvalue()). Retorna un BytesIO nuevo.
+    """
+    headers, rows = _word_sheet_rows(io.BytesIO(docx_bytes), initiative_name, common_headers)
+    excel_bio.seek(0)
+    wb = openpyxl.load_workbook(excel_bio)
+    create_excel_sheet_from_word(wb, _safe_sheet_name(initiative_name), headers, rows)
+    return _workbook_to_bytes(wb)
+
+
+def docx_to_sheet_rows(
+    docx_bytes: bytes,
+    initiative_name: str,
+    common_headers: list[str] = None,
+) -> tuple[str, list[str], list[dict]]:
+    """
+    Parsea un Word (bytes) a (nombre de hoja, headers, filas) sin tocar ningún workbook.
+    Es independiente por documento, así que puede correr en paralelo.
+    """
+    headers, rows = _word_sheet_rows(io.BytesIO(docx_bytes), initiative_name, common_headers)
+    return _safe_sheet_name(initiative_name), headers, rows
+
+
+def add_word_sheets_to_excel_bytes(
+    excel_bio: io.BytesIO,
+    word_docs: list[tuple[str, bytes]],
+    common_headers: list[str] = None,
+    max_workers: int = 8,
+) -> io.BytesIO:
+    """
+    Agrega varios Word como hojas del Excel (en memoria).
+    word_docs: lista de (nombre de iniciativa, bytes del .docx).
+    Los Word se parsean en paralelo; el workbook se abre y se guarda una sola vez.
+    Las hojas quedan en el mismo orden que word_docs.
+    """
+    if not word_docs:
+        return excel_bio
+    workers = min(max_workers, len(word_docs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parsed = list(executor.map(
+            lambda doc: docx_to_sheet_rows(doc[1], doc[0], common_headers), word_docs
+        ))
+
+    excel_bio.seek(0)
+    wb = openpyxl.load_workbook(excel_bio)
+    for sheet_name, headers, rows in parsed:
+        create_excel_sheet_from_word(wb, sheet_name, headers, rows)
+    return _workbook_to_bytes(wb)
+
+
+def _load_workbook_rows(src) -> list[tuple[str, list[tuple], dict, dict]]:
+    """
+    Lee un Excel (ruta o file-like) y retorna por hoja (título, filas de valores, altos, anchos).
+    Solo datos planos: se puede ejecutar en otro proceso y devolver el resultado por pickle.
+    Carga en modo normal: read_only no expone dimensiones y data_only perdería las fórmulas.
+    """
+    wb = openpyxl.load_workbook(src)
+    sheets = []
+    for ws in wb.worksheets:
+        heights = {r: d.height for r, d in ws.row_dimensions.items() if d.height}
+        widths = {c: d.width for c, d in ws.column_dimensions.items() if d.width}
+        sheets.append((ws.title, list(ws.iter_rows(values_only=True)), heights, widths))
+    wb.close()
+    return sheets
+
+
+# Parseo en paralelo (un proceso por archivo): cada proceso spawn reimporta openpyxl y python-docx,
+# así que solo compensa con archivos grandes (app.py consolida en cada rerun completo)
+_PARALLEL_MERGE_MIN_BYTES = 1 * 1024 * 1024
+
+
+def _source_size(src) -> int:
+    """Tamaño en bytes de una ruta o un file-like (sin leer su contenido)."""
+    if isinstance(src, str):
+        return os.path.getsize(src)
+    pos = src.tell()
+    size = src.seek(0, 2)
+    src.seek(pos)
+    return size
+
+
+def _load_sources_parallel(srcs: list) -> list | None:
+    """
+    Parsea varios Excel en procesos separados (el parseo XML de openpyxl no suelta el GIL).
+    Usa "spawn" por el mismo motivo que hu_analyzer: puede llamarse desde un hilo de Streamlit.
+    Retorna None si el pool falla, para que el llamador lea en secuencia.
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(srcs), os.cpu_count()),
+                                 mp_context=multiprocessing.get_context("spawn")) as ex:
+            return list(ex.map(_load_workbook_rows, srcs))
+    except Exception:
+        return None
+
+
+def _copy_sheet(sheet: tuple, target_wb: openpyxl.Workbook, sheet_name: str) -> None:
+    """Copia una hoja parseada por _load_workbook_rows al workbook destino (valores y dimensiones)."""
     if sheet_name in target_wb.sheetnames:
         return  # ya existe, no sobrescribir
+    _, rows, heights, widths = sheet
     new_ws = target_wb.create_sheet(title=sheet_name)
-    for row in source_ws.iter_rows():
-        for cell in row:
-            new_ws.cell(row=cell.row, column=cell.column, value=cell.value)
-    for row_num, dim in source_ws.row_dimensions.items():
-        if dim.height:
-            new_ws.row_dimensions[row_num].height = dim.height
-    for col_letter, dim in source_ws.column_dimensions.items():
-        if dim.width:
-            new_ws.column_dimensions[col_letter].width = dim.width
+    # iter_rows arranca en la fila 1 y append en la 1 de la hoja nueva: las filas quedan alineadas
+    for row_values in rows:
+        new_ws.append(row_values)
+    for row_num, height in heights.items():
+        new_ws.row_dimensions[row_num].height = height
+    for col_letter, width in widths.items():
+        new_ws.column_dimensions[col_letter].width = width
 
 
-def merge_excel_files(excel_paths: list[str], output_path: str) -> str:
+def _next_free_sheet_name(name: str, used_names: set[str], counters: dict[str, int]) -> str:
     """
-    Consolida múltiples archivos Excel en uno solo.
-    Cada hoja de cada archivo se agrega como pestaña. Si hay conflicto de nombres,
-    se usa el nombre del archivo como prefijo (ej: "Archivo1_Iniciativa").
-    Retorna la ruta del Excel consolidado.
+    Primer "<name>_<n>" libre (máx. 31 caracteres). El contador por nombre base evita
+    reprobar los sufijos ya usados; la base se recorta antes de agregar el sufijo.
+    """
+    idx = counters.get(name, 0)
+    while True:
+        idx += 1
+        suffix = f"_{idx}"
+        candidate = name[:31 - len(suffix)] + suffix
+        if candidate not in used_names:
+            counters[name] = idx
+            return candidate
+
+
+def _merge_workbooks(sources: list[tuple[str, object]]) -> openpyxl.Workbook:
     """
-    if not excel_paths:
+    Consolida los workbooks (nombre, ruta o file-like) en el primero.
+    El nombre del archivo se usa como prefijo si hay conflicto de nombres de hoja.
+    Con más de un archivo extra, más de un CPU y al menos _PARALLEL_MERGE_MIN_BYTES entre los
+    extras, se parsean en paralelo; si no, uno a la vez (solo un workbook parseado en memoria).
+    La copia al destino sigue siendo secuencial para conservar el orden de las hojas.
+    """
+    if not sources:
         raise ValueError("Se requiere al menos un archivo Excel.")
-    wb_target = openpyxl.load_workbook(excel_paths[0])
+    wb_target = openpyxl.load_workbook(sources[0][1])
     used_names = set(wb_target.sheetnames)
-
-    for path in excel_paths[1:]:
-        wb_src = openpyxl.load_workbook(path)
-        base_name = os.path.splitext(os.path.basename(path))[0]
-        for ws in wb_src.worksheets:
-            name = ws.title
+    suffix_counters: dict[str, int] = {}
+
+    extra = sources[1:]
+    parsed = None
+    if (len(extra) >= 2 and (os.cpu_count() or 1) > 1
+            and sum(_source_size(src) for _, src in extra) >= _PARALLEL_MERGE_MIN_BYTES):
+        parsed = _load_sources_parallel([src for _, src in extra])
+    if parsed is None:
+        parsed = (_load_workbook_rows(src) for _, src in extra)
+
+    for (base_name, _), sheets in zip(extra, parsed):
+        for sheet in sheets:
+            name = sheet[0]
             if name in used_names:
                 name = f"{base_name}_{name}"[:31]
             if name in used_names:
-                idx = 1
-                while f"{name}_{idx}"[:31] in used_names:
-                    idx += 1
-                name = f"{name}_{idx}"[:31]
+                name = _next_free_sheet_name(name, used_names, suffix_counters)
             used_names.add(name)
-            _copy_sheet(ws, wb_target, name)
-        wb_src.close()
+            _copy_sheet(sheet, wb_target, name)
+    return wb_target
 
+
+def merge_excel_files(excel_paths: list[str], output_path: str) -> str:
+    """
+    Consolida múltiples archivos Excel en uno solo.
+    Cada hoja de cada archivo se agrega como pestaña. Si hay conflicto de nombres,
+    se usa el nombre del archivo como prefijo (ej: "Archivo1_Iniciativa").
+    Retorna la ruta del Excel consolidado.
+    """
+    sources = [(os.path.splitext(os.path.basename(p))[0], p) for p in excel_paths]
+    wb_target = _merge_workbooks(sources)
     wb_target.save(output_path)
     return output_path
 
 
+def merge_excel_files_bytes(files: list[tuple[str, bytes]]) -> io.BytesIO:
+    """
+    Igual que merge_excel_files pero en memoria.
+    files: lista de (nombre de archivo, contenido). Retorna el Excel consolidado como BytesIO.
+    """
+    sources = [(os.path.splitext(os.path.basename(name))[0], io.BytesIO(data)) for name, data in files]
+    return _workbook_to_bytes(_merge_workbooks(sources))
+
+
 def word_to_excel_file(docx_path: str, output_xlsx_path: str, initiative_name: str = None) -> str:
     """
     Convierte un .docx a archivo Excel con una hoja.
@@ -525,15 +744,23 @@ def word_to_excel_file(docx_path: str, output_xlsx_path: str, initiative_name: s
     if not rows:
         raise ValueError("No se encontraron HUs en el documento Word.")
 
-    wb = openpyxl.Workbook()
-    name = initiative_name or __import__("os").path.splitext(__import__("os").path.basename(docx_path))[0]
-    # Sanitizar nombre de hoja (máx 31 chars, sin caracteres prohibidos)
-    sheet_name = re.sub(r'[\\/*?:\[\]]', '_', name)[:31]
+    wb = _empty_workbook()
+    name = initiative_name or os.path.splitext(os.path.basename(docx_path))[0]
+    sheet_name = _safe_sheet_name(name)
     create_excel_sheet_from_word(wb, sheet_name, headers, rows)
-    # Eliminar hoja por defecto (Sheet)
-    for ws in list(wb.worksheets):
-        if ws.title != sheet_name:
-            wb.remove(ws)
-            break
     wb.save(output_xlsx_path)
     return output_xlsx_path
+
+
+def word_to_excel_bytes(docx_bytes: bytes, initiative_name: str) -> io.BytesIO:
+    """
+    Convierte un .docx (bytes) a Excel con una hoja, en memoria.
+    Retorna el Excel como BytesIO.
+    """
+    headers, rows = word_to_hus(io.BytesIO(docx_bytes), initiative_name)
+    if not rows:
+        raise ValueError("No se encontraron HUs en el documento Word.")
+
+    wb = _empty_workbook()
+    create_excel_sheet_from_word(wb, _safe_sheet_name(initiative_name), headers, rows)
+    return _workbook_to_bytes(wb)